@@ -1,13 +1,11 @@
 import os
 import cv2
 import numpy as np
-from PIL import Image
-import matplotlib.pyplot as plt
-from collections import defaultdict
-from scipy.spatial.distance import pdist, squareform
 from typing import List, Dict, Tuple, Any, Set
 from pathlib import Path
 import json
+import pickle
+import threading
 from config import OUTPUT_PATH
 
 
@@ -18,11 +16,12 @@ class ImageAnalyzer:
     This groups logos by similarities, using traditional computer vision algorithms.
     """
     
-    def __init__(self, input_dir: str = ".", threshold: float = 0.75, output_dir: str = OUTPUT_PATH):
+    def __init__(self, input_dir: str = ".", threshold: float = 0.75, output_dir: str = OUTPUT_PATH, aliases: Dict[str, List[str]] = None):
         """
         Params:
             input_dir: Location where the images have been downloaded by the scraper.
             threshold: The threshold that considers logos similar. (0.0 to 1.0)
+            aliases: Canonical domain -> original spellings. Groups list every spelling of a domain.
 
             Note: the higher the threshold (closer to 1.0), the more strict the similarity check is. 
             0.60-0.75 by default is fairly balanced.
@@ -31,9 +30,12 @@ class ImageAnalyzer:
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.threshold = threshold
+        self.aliases = aliases or {}
         self.logos = [] # (path, features)
         self.similarity_graph = None 
         self.logo_groups = []
+        self._lock = threading.Lock()
+        # add_logo() may run in worker threads while the refresh daemon groups.
 
 
         self.img_extensions = {
@@ -320,9 +322,13 @@ class ImageAnalyzer:
 
         group_info = []
         for i, group in enumerate(groups):
+            domains = []
+            for logo in group:
+                domain = os.path.splitext(self.logos[logo][0].name)[0]
+                domains.extend(self.aliases.get(domain, [domain]))
             group_info.append({
                 "group_num": i,
-                "domains": [os.path.splitext(self.logos[logo][0].name)[0] for logo in group]
+                "domains": domains
             })
         return group_info
 
@@ -339,13 +345,113 @@ class ImageAnalyzer:
         
         print("Extracting image features...")
         for img_path in logo_files:
-            features = self.extract_features(img_path)
-            if features is not None:
-                self.logos.append((img_path, features))
+            self.add_logo(img_path)
         
-        groups = self.group_similar_logos()
-        self.logo_groups = groups
-        grouped_domains = self.normalize_information(self.logo_groups)
+        self.group_and_save()
+
+    def add_logo(self, img_path) -> Dict[str, Any]:
+        """
+        Extracts one logo's features and keeps them for grouping. Returns the features (None if the image can't be read).
+        The streaming pipeline calls this as soon as each logo is saved, instead of walking input_dir at the end.
+        """
+        img_path = Path(img_path)
+        features = self.extract_features(str(img_path))
+        if features is None:
+            return None
+        with self._lock:
+            self.logos.append((img_path, features))
+        return features
+
+    def logo_domains(self) -> Set[str]:
+        """
+        Domains (image file names) of the logos added or loaded so far.
+        """
+        return {os.path.splitext(path.name)[0] for path, _ in self.logos}
+
+    def save_state(self, path: str):
+        """
+        Saves the features and groups, so the next incremental run only handles new and changed logos,
+        and the aliases, so grouping alone (analyze.py) doesn't have to read the input again.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with self._lock, open(tmp_path, "wb") as f:
+            pickle.dump({"threshold": self.threshold, "logos": self.logos, "groups": self.logo_groups, "aliases": self.aliases}, f)
+        os.replace(tmp_path, path)
+
+    def load_state(self, path: str) -> bool:
+        """
+        Loads the features and groups saved by an earlier run. Groups made with another threshold are dropped
+        (the logos are then grouped again from scratch). The saved aliases are used if none were given.
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except Exception as err:
+            print(f"Could not load the saved logo features from {path}. ERR: {err}")
+            return False
+
+        self.logos = state["logos"]
+        self.logo_groups = state["groups"] if state["threshold"] == self.threshold else []
+        self.aliases = self.aliases or state.get("aliases") or {}
+        print(f"Loaded {len(self.logos)} logos in {len(self.logo_groups)} groups from {path}.")
+        return True
+
+    def extend_groups(self, removed: Set[str] = None) -> List[List[int]]:
+        """
+        Incremental grouping: keeps the loaded groups and only places the logos that aren't grouped yet.
+
+        A logo added again for the same domain (changed logo) replaces the old one, logos of `removed` domains are dropped.
+        A group losing its first logo (the one every member was compared to) is dissolved and its members placed again.
+        Each logo to place joins the first group whose first logo is similar enough, or starts a new group,
+        which is what group_similar_logos() does for logos appended at the end.
+        """
+        removed = removed or set()
+        latest = {}
+        for i, (path, _) in enumerate(self.logos):
+            latest[os.path.splitext(path.name)[0]] = i
+        alive = sorted(i for domain, i in latest.items() if domain not in removed)
+        remap = {old: new for new, old in enumerate(alive)}
+
+        groups = []
+        to_place = []
+        for group in self.logo_groups:
+            if group[0] in remap:
+                groups.append([remap[logo] for logo in group if logo in remap])
+            else:
+                to_place.extend(remap[logo] for logo in group[1:] if logo in remap)
+        grouped = {logo for group in groups for logo in group}
+        to_place = sorted(set(to_place) | {i for i in range(len(alive)) if i not in grouped})
+
+        self.logos = [self.logos[i] for i in alive]
+        print(f"Placing {len(to_place)} logos into {len(groups)} existing groups ...")
+        for i in to_place:
+            features = self.logos[i][1]
+            for group in groups:
+                if self.calculate_similarity(self.logos[group[0]][1], features) >= self.threshold:
+                    group.append(i)
+                    break
+            else:
+                groups.append([i])
+        return groups
+
+    def group_and_save(self, incremental: bool = False, removed: Set[str] = None):
+        """
+        Groups every logo added so far and saves the groups to .json
+
+        Params:
+            incremental: Keep the groups loaded with load_state() and only place new and changed logos (see extend_groups).
+            removed: Domains whose logos are dropped (no longer in the input).
+        """
+        with self._lock:
+            if incremental:
+                groups = self.extend_groups(removed)
+            else:
+                groups = self.group_similar_logos()
+            self.logo_groups = groups
+            grouped_domains = self.normalize_information(self.logo_groups)
         self.json_save(grouped_domains, output_path=self.output_dir)
         
 
@@ -0,0 +1,245 @@
+import asyncio
+from urllib.parse import urlparse
+from typing import Any, Dict, Optional
+
+from Utils.headers import headers_randomizer
+
+
+BROWSER_ARGS = [
+    "--no-sandbox",
+    "--disable-blink-features=AutomationControlled",
+    "--disable-web-security",
+    "--disable-features=VizDisplayCompositor",
+    "--disable-dev-shm-usage",
+    "--no-first-run",
+    "--disable-extensions"
+]
+
+
+# "logo" render mode: resource types that are never needed to find a logo.
+BLOCKED_RESOURCE_TYPES = {"font", "stylesheet", "media", "texttrack", "eventsource", "websocket", "manifest", "other"}
+
+TRACKER_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "facebook.net", "connect.facebook.net", "hotjar.com", "clarity.ms", "segment.io", "segment.com",
+    "mixpanel.com", "newrelic.com", "nr-data.net", "optimizely.com", "criteo.com", "taboola.com",
+    "outbrain.com", "adnxs.com", "scorecardresearch.com", "quantserve.com", "tiktok.com", "linkedin.com"
+)
+
+LOGO_SELECTORS = ", ".join([
+    "header img", "header svg", "[class*='logo']", "[id*='logo']", "img[src*='logo']",
+    "[class*='brand']", "link[rel*='icon']", "meta[property='og:image']"
+])
+
+LOGO_HINTS = ("logo", "brand", "icon", ".svg")
+
+
+def is_tracker(url: str) -> bool:
+    host = urlparse(url).hostname or ""
+    return any(host == tracker or host.endswith("." + tracker) for tracker in TRACKER_HOSTS)
+
+
+def is_logo_candidate(url: str) -> bool:
+    return any(hint in url.lower() for hint in LOGO_HINTS)
+
+
+class BrowserPool:
+    """
+    Long-lived pool of headless Chromium browsers, used as a fallback tier by the scraper.
+
+    Each worker owns one browser and one context, reused across pages, and pulls URLs from a shared queue.
+    A browser is recycled after `pages_per_browser` pages or when it crashes.
+    Playwright is only started on the first fetch, so runs without fallbacks never launch a browser.
+
+    Render modes:
+        "full": loads the whole page and waits for domcontentloaded.
+        "logo": blocks fonts, stylesheets, media, trackers and non-logo images, and captures the HTML
+                as soon as a header / logo element is attached. Logo-looking image responses seen on
+                the wire can be recorded, so the downloader doesn't fetch them a second time.
+    """
+
+    def __init__(self, size: int = 3, pages_per_browser: int = 50, queue_size: int = 1000, page_timeout: int = 10000,
+                 render_mode: str = "logo", capture_logos: bool = True):
+        """
+        Params:
+            size: Number of browsers (and workers).
+            pages_per_browser: Pages rendered before a browser is closed and launched again.
+            queue_size: Maximum number of URLs waiting for a browser.
+            page_timeout: Navigation timeout in milliseconds.
+            render_mode: "full" or "logo".
+            capture_logos: In "logo" mode, keep the bodies of logo-looking image responses.
+        """
+        self.size = size
+        self.pages_per_browser = pages_per_browser
+        self.page_timeout = page_timeout
+        self.render_mode = render_mode
+        self.capture_logos = capture_logos and render_mode == "logo"
+
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._playwright = None
+        self._workers = []
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._start_lock:
+            if self._playwright is not None:
+                return
+            from playwright.async_api import async_playwright
+            # Loaded on the first headless render, most runs never need a browser.
+            self._playwright = await async_playwright().start()
+            self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.size)]
+
+    async def fetch(self, url: str, domain: str) -> Dict[str, Any]:
+        """
+        Queues a URL for rendering and waits for the result.
+        The caller doesn't hold any scraper slot while waiting.
+        """
+        if not url:
+            return {}
+
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((url, domain, future))
+        return await future
+
+    async def _launch(self):
+        browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+        headers = headers_randomizer("")
+        light = self.render_mode == "logo"
+        context = await browser.new_context(
+            user_agent=headers["User-Agent"],
+            viewport={"width": 1280, "height": 720} if light else {"width": 1920, "height": 1080},
+            locale="en-US",
+            timezone_id="America/New_York",
+            extra_http_headers={
+                "Accept-Language": "en-US,en;q=0.9",
+            }
+        )
+        if light:
+            await context.route("**/*", self._route_light)
+        return browser, context
+
+    async def _route_light(self, route):
+        request = route.request
+        resource_type = request.resource_type
+
+        if is_tracker(request.url):
+            await route.abort()
+        elif resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        elif resource_type == "image" and not is_logo_candidate(request.url):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _close(self, browser):
+        if browser is None:
+            return
+        try:
+            await browser.close()
+        except Exception as err:
+            print(f"Error closing headless browser. ERR: {err}")
+
+    async def _worker(self, worker_id: int):
+        browser = context = None
+        pages = 0
+
+        while True:
+            url, domain, future = await self._queue.get()
+            if future.done():
+                # The caller gave up (deadline), don't render for nobody.
+                self._queue.task_done()
+                continue
+            try:
+                if browser is None or not browser.is_connected() or pages >= self.pages_per_browser:
+                    await self._close(browser)
+                    browser = context = None
+                    browser, context = await self._launch()
+                    pages = 0
+
+                result = await self._render(context, url, domain)
+                pages += 1
+            except Exception as err:
+                print(f"Headless worker {worker_id} crashed on {url}, recycling browser. ERR: {err}")
+                await self._close(browser)
+                browser = context = None
+                result = self._empty_result(domain)
+                result["error"] = f"Headless browser error: {err}"
+            finally:
+                self._queue.task_done()
+
+            if not future.done():
+                future.set_result(result)
+
+    def _empty_result(self, domain: str) -> Dict[str, Any]:
+        return {
+            "domain": domain,
+            "success": False,
+            "status_code": None,
+            "html": None,
+            'error': None,
+            "url": None
+        }
+
+    async def _render(self, context, url: str, domain: str) -> Dict[str, Any]:
+        result = self._empty_result(domain)
+        page = await context.new_page()
+        captures = []
+
+        if self.capture_logos:
+            def on_response(response):
+                if response.request.resource_type == "image" and response.ok and is_logo_candidate(response.url):
+                    captures.append(asyncio.ensure_future(self._capture(response)))
+            page.on("response", on_response)
+
+        try:
+            if self.render_mode == "logo":
+                res = await page.goto(url, timeout=self.page_timeout, wait_until="commit")
+                try:
+                    await page.wait_for_selector(LOGO_SELECTORS, state="attached", timeout=self.page_timeout)
+                except Exception:
+                    await page.wait_for_load_state("domcontentloaded", timeout=self.page_timeout)
+            else:
+                res = await page.goto(url, timeout=self.page_timeout, wait_until="domcontentloaded")
+
+            if res:
+                result["status_code"] = res.status
+                if res.ok:
+                    result["success"] = True
+                    result["html"] = await page.content()
+                    result["url"] = page.url
+                else:
+                    result["error"] = f"{res.status} error."
+            else:
+                result["error"] = "No response"
+        except Exception as err:
+            print(f"Error fetching {url} with a headless browser. ERR: {err}")
+            result["error"] = f"Headless browser error: {err}"
+        finally:
+            if captures:
+                captured = await asyncio.gather(*captures, return_exceptions=True)
+                result["logo_responses"] = dict(c for c in captured if isinstance(c, tuple))
+            try:
+                await page.close()
+            except Exception:
+                pass
+
+        return result
+
+    async def _capture(self, response):
+        return response.url, await response.body()
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        while not self._queue.empty():
+            _, domain, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_result(self._empty_result(domain))
+
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
@@ -0,0 +1,94 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import idna
+from typing import Dict, List, Optional
+
+
+_VALID_HOSTNAME = r"^[a-z0-9_-]+(\.[a-z0-9_-]+)+$"
+
+
+def idna_encode(domain: str) -> Optional[str]:
+    """
+        Converts an unicode domain to its ASCII (punycode) form. Returns None if it cannot be encoded.
+    """
+    try:
+        return idna.encode(domain, uts46=True).decode("ascii")
+    except (idna.IDNAError, UnicodeError):
+        return None
+
+
+def canonicalize(domains: pa.Array) -> pa.Array:
+    """
+        Canonicalizes a batch of domains with Arrow compute kernels.
+
+        Lowercases, trims whitespace, drops schemes, paths, ports, `www.` prefixes and trailing dots,
+        then IDNA-encodes the non-ASCII rows. Rows that do not end up as a hostname become null.
+
+        Args:
+            domains: Arrow string array with the raw domains.
+
+        Returns:
+            Arrow string array (same length) with the canonical domains.
+    """
+
+    canonical = pc.utf8_lower(domains)
+    canonical = pc.utf8_trim_whitespace(canonical)
+    canonical = pc.replace_substring_regex(canonical, r"^[a-z][a-z0-9+.-]*://", "")
+    canonical = pc.replace_substring_regex(canonical, r"[/?#].*$", "")
+    canonical = pc.replace_substring_regex(canonical, r":\d*$", "")
+    canonical = pc.replace_substring_regex(canonical, r"^www\d*\.", "")
+    canonical = pc.replace_substring_regex(canonical, r"\.+$", "")
+
+    # There's no IDNA kernel, so only the (rare) non-ASCII rows go through Python.
+    non_ascii = pc.fill_null(pc.invert(pc.string_is_ascii(canonical)), False)
+    if pc.any(non_ascii).as_py():
+        cache = {}
+        encoded = []
+        for domain in pc.filter(canonical, non_ascii).to_pylist():
+            if domain not in cache:
+                cache[domain] = idna_encode(domain)
+            encoded.append(cache[domain])
+        canonical = pc.replace_with_mask(canonical, non_ascii, pa.array(encoded, pa.string()))
+
+    valid = pc.fill_null(pc.match_substring_regex(canonical, _VALID_HOSTNAME), False)
+    return pc.if_else(valid, canonical, pa.scalar(None, pa.string()))
+
+
+class DomainIndex:
+    """
+    Deduplication index for canonical domains.
+
+    Keeps, for each canonical domain, every original spelling seen in the input, so results computed
+    once per canonical domain can still be fanned out to each input row.
+    """
+
+    def __init__(self):
+        self.aliases: Dict[str, List[str]] = {}
+        self.rows_seen = 0
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def add(self, domains: pa.Array) -> List[str]:
+        """
+            Canonicalizes a batch and records its spellings.
+
+            Returns:
+                The canonical domains of the batch that were not seen in previous batches.
+        """
+        self.rows_seen += len(domains)
+        table = pa.table({"canonical": canonicalize(domains), "original": domains})
+        table = table.filter(pc.is_valid(table["canonical"]))
+
+        grouped = table.group_by("canonical").aggregate([("original", "distinct")])
+        new_domains = []
+
+        for canonical, originals in zip(grouped["canonical"].to_pylist(), grouped["original_distinct"].to_pylist()):
+            known = self.aliases.get(canonical)
+            if known is None:
+                self.aliases[canonical] = originals
+                new_domains.append(canonical)
+            else:
+                known.extend(o for o in originals if o not in known)
+
+        return new_domains
@@ -0,0 +1,75 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+
+_FAILED = object()
+
+
+class Coalescer:
+    """
+    In-flight and completed request coalescing.
+
+    The first caller for a key runs the work; callers arriving while it runs wait for the same result,
+    and callers arriving later get the stored result (the last `max_completed` keys, and at most `max_bytes`, are kept).
+    Only results passing `keep` are shared: on a failure, waiters redo the work and nothing is stored.
+    """
+
+    def __init__(self, max_completed: int = 10000, keep: Callable[[Any], bool] = lambda result: result is not None, size: Optional[Callable[[Any], int]] = None, max_bytes: Optional[int] = None):
+        """
+        Params:
+            max_completed: Number of completed results kept (least recently used ones are dropped).
+            keep: Whether a result may be stored and handed to later callers.
+            size, max_bytes: Size of a result (bytes) and the total size of the stored results, bodies being large.
+        """
+        self.max_completed = max_completed
+        self.keep = keep
+        self.size = size
+        self.max_bytes = max_bytes
+        self.stored_bytes = 0
+        self._in_flight = {}
+        self._completed = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Returns (result, shared). shared is True when the result came from another caller's work.
+        """
+        if key in self._completed:
+            self._completed.move_to_end(key)
+            self.hits += 1
+            return self._completed[key], True
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            result = await asyncio.shield(future)
+            if result is not _FAILED and self.keep(result):
+                self.hits += 1
+                return result, True
+            # The first caller failed (raised, was cancelled or got a failed result), do the work here instead.
+            return await work(), False
+
+        self.misses += 1
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        result = _FAILED
+        try:
+            result = await work()
+            if self.keep(result):
+                self._store(key, result)
+            return result, False
+        finally:
+            future.set_result(result)
+            del self._in_flight[key]
+
+    def _store(self, key: Hashable, result: Any):
+        if self.size is not None:
+            self.stored_bytes += self.size(result) - (self.size(self._completed[key]) if key in self._completed else 0)
+        self._completed[key] = result
+        while self._completed and (len(self._completed) > self.max_completed or (self.max_bytes is not None and self.stored_bytes > self.max_bytes)):
+            _, dropped = self._completed.popitem(last=False)
+            if self.size is not None:
+                self.stored_bytes -= self.size(dropped)
+
+    def snapshot(self):
+        return {"hits": self.hits, "misses": self.misses, "completed": len(self._completed), "stored_mb": round(self.stored_bytes / 2**20, 1)}
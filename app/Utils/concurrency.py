@@ -0,0 +1,225 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+
+# Innermost limiter slot held by the running code (a slot taken inside another one points to it).
+_current_slot: ContextVar[Optional["_Slot"]] = ContextVar("limiter_slot", default=None)
+
+
+class AIMDLimiter:
+    """
+    Adaptive in-flight limit for one pipeline stage (additive increase, multiplicative decrease).
+
+    The limit grows by `increase` every time `limit` requests complete without congestion and with a
+    latency close to the best seen so far. Timeouts, resets and 429/503 responses shrink it by `decrease`,
+    at most once per `cooldown` seconds so a single burst of failures doesn't collapse it.
+    """
+
+    def __init__(self, name: str, initial: int = 50, minimum: int = 5, maximum: int = 1000,
+                 increase: int = 1, decrease: float = 0.7, cooldown: float = 1.0, latency_tolerance: float = 2.0):
+        """
+        Params:
+            name: Stage name, used for monitoring.
+            initial, minimum, maximum: Starting limit and its bounds.
+            increase: Added to the limit after a full window of healthy completions.
+            decrease: Factor applied to the limit on congestion.
+            cooldown: Minimum seconds between two decreases.
+            latency_tolerance: Completions slower than this multiple of the baseline latency don't count as healthy.
+        """
+        self.name = name
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.completed = 0
+        self.congestion_events = 0
+        self.baseline_latency: Optional[float] = None
+
+        self._healthy = 0
+        self._last_decrease = float("-inf")
+        self._cond = asyncio.Condition()
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.limit
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency: Optional[float] = None, congested: bool = False):
+        async with self._cond:
+            self.in_flight -= 1
+            self.completed += 1
+
+            if congested:
+                self._decrease()
+            elif self._is_healthy(latency):
+                self._healthy += 1
+                if self._healthy >= self.limit:
+                    self.limit = min(self.maximum, self.limit + self.increase)
+                    self._healthy = 0
+
+            self._cond.notify_all()
+
+    async def give_back(self):
+        """
+        Frees a slot without completing it (the holder is only waiting), see polite_wait().
+        """
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def signal_congestion(self):
+        """
+        Reports congestion seen in the middle of a request (e.g. one of several attempts hit a 429).
+        """
+        self._decrease()
+
+    def _decrease(self):
+        self.congestion_events += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, int(self.limit * self.decrease))
+        self._healthy = 0
+
+    def _is_healthy(self, latency: Optional[float]) -> bool:
+        if latency is None:
+            return True
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+            return True
+
+        # Slowly drifting minimum, so the baseline can recover after a fast outlier.
+        self.baseline_latency = min(latency, self.baseline_latency * 1.01)
+        return latency <= self.baseline_latency * self.latency_tolerance
+
+    def slot(self) -> "_Slot":
+        """
+        async with limiter.slot() as slot:
+            ...
+            slot.congested = True
+        """
+        return _Slot(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "congestion_events": self.congestion_events,
+            "baseline_latency": self.baseline_latency,
+        }
+
+
+class _Slot:
+    def __init__(self, limiter: AIMDLimiter):
+        self.limiter = limiter
+        self.congested = False
+        self.started = None
+        self.held = False
+        self.paused = 0.0
+        self.parent = None
+        self._waiting = 0
+        self._lock = asyncio.Lock()
+        self._token = None
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.held = True
+        self.started = time.monotonic()
+        self.parent = _current_slot.get()
+        self._token = _current_slot.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _current_slot.reset(self._token)
+        congested = self.congested or isinstance(exc, asyncio.TimeoutError)
+        if not self.held:
+            self.limiter.in_flight += 1
+            # Given back by a wait that was cancelled, counted again so release() balances.
+        await self.limiter.release(max(time.monotonic() - self.started - self.paused, 0.0), congested)
+        return False
+
+    async def pause(self):
+        async with self._lock:
+            if self.held and self._waiting == 0:
+                await self.limiter.give_back()
+                self.held = False
+            self._waiting += 1
+
+    async def resume(self, cancelled: bool = False):
+        # Hedged requests share the slot: the first waiter done takes it back for both.
+        async with self._lock:
+            self._waiting -= 1
+            if not self.held and not cancelled:
+                await self.limiter.acquire()
+                self.held = True
+
+
+async def polite_wait(scheduler, host: str, ip: Optional[str] = None) -> float:
+    """
+    scheduler.wait() for a request made inside limiter slots: the slots are given back while sleeping
+    and taken again after, so domains queued behind a busy shared IP don't fill the stage's limit just
+    waiting, and the wait isn't counted in the slots' latency samples. Returns the delay.
+    """
+    delay = scheduler.reserve(host, ip)
+    if delay <= 0:
+        return delay
+
+    slots = []
+    slot = _current_slot.get()
+    while slot is not None:
+        slots.append(slot)
+        slot = slot.parent
+    if not slots:
+        await asyncio.sleep(delay)
+        return delay
+
+    started = time.monotonic()
+    for slot in slots:
+        await slot.pause()
+    try:
+        await asyncio.sleep(delay)
+    except asyncio.CancelledError:
+        for slot in slots:
+            await slot.resume(cancelled=True)
+        raise
+    # Outer slots first, the order they were taken in.
+    for slot in reversed(slots):
+        await slot.resume()
+    for slot in slots:
+        slot.paused += time.monotonic() - started
+    return delay
+
+
+class ConcurrencyController:
+    """
+    One AIMD limiter per pipeline stage (resolve, scrape, download, ...), with their current limits exposed for monitoring.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Params:
+            limits: stage -> AIMDLimiter keyword arguments (initial, minimum, maximum, ...).
+        """
+        self.limits = limits or {}
+        self.stages: Dict[str, AIMDLimiter] = {}
+
+    def stage(self, name: str) -> AIMDLimiter:
+        if name not in self.stages:
+            self.stages[name] = AIMDLimiter(name, **self.limits.get(name, {}))
+        return self.stages[name]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: limiter.snapshot() for name, limiter in self.stages.items()}
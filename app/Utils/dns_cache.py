@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+class DNSCache:
+    """
+    On-disk DNS cache backed by SQLite.
+
+    Answers are kept for their TTL (clamped between min_ttl and max_ttl).
+    NXDOMAIN answers are cached for negative_ttl, timeouts and other failures for failure_ttl,
+    so dead domains are not queried again on every run.
+    """
+
+    def __init__(self, path: str, negative_ttl: int = 86400, failure_ttl: int = 3600, min_ttl: int = 3600, max_ttl: int = 604800):
+        """
+        Params:
+            path: SQLite database file. Created if missing.
+            negative_ttl: Seconds a NXDOMAIN / no data answer is trusted.
+            failure_ttl: Seconds a timeout / SERVFAIL / other error is trusted.
+            min_ttl, max_ttl: Bounds applied to the TTL returned by the nameserver.
+        """
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.failure_ttl = failure_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        # Shard processes share the file, wait for each other's write transactions.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dns_cache (
+                domain TEXT PRIMARY KEY,
+                resolved_ip TEXT,
+                status TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def lookup(self, domains: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Splits the domains into cached answers and domains that have to be queried.
+
+        Returns:
+            (hits, misses): hits are result dicts (including cached failures),
+            misses are the domains that are missing or expired.
+        """
+        now = time.time()
+        found = {}
+        chunk_size = 900
+        # SQLite limits the number of bound parameters per statement.
+
+        for i in range(0, len(domains), chunk_size):
+            chunk = domains[i:i+chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT domain, resolved_ip, status FROM dns_cache WHERE expires_at > ? AND domain IN ({placeholders})",
+                (now, *chunk)
+            )
+            for domain, resolved_ip, status in rows:
+                found[domain] = {"domain": domain, "resolved_ip": resolved_ip, "status": status}
+
+        hits = list(found.values())
+        misses = [domain for domain in domains if domain not in found]
+        return hits, misses
+
+    def expiry(self, result: Dict[str, Any], now: float) -> float:
+        status = result.get("status")
+        if status == "success":
+            ttl = result.get("ttl") or self.min_ttl
+            return now + min(max(ttl, self.min_ttl), self.max_ttl)
+        if status == "nxdomain":
+            return now + self.negative_ttl
+        return now + self.failure_ttl
+
+    def store(self, results: Iterable[Dict[str, Any]]):
+        """
+        Upserts resolution results in a single transaction.
+        """
+        now = time.time()
+        rows = [
+            (r["domain"], r.get("resolved_ip"), r.get("status") or "error", self.expiry(r, now), now)
+            for r in results if isinstance(r, dict)
+        ]
+        if not rows:
+            return
+
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO dns_cache (domain, resolved_ip, status, expires_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(domain) DO UPDATE SET
+                    resolved_ip=excluded.resolved_ip,
+                    status=excluded.status,
+                    expires_at=excluded.expires_at,
+                    updated_at=excluded.updated_at
+                """,
+                rows
+            )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Dict, Optional
+
+from Utils.retry_policy import NXDOMAIN, REFUSED, TLS, TIMEOUT, NETWORK, HTTP_4XX, HTTP_5XX, RATE_LIMITED, INVALID, UNKNOWN
+
+
+class ErrorCode(IntEnum):
+    """
+    Small integer codes for the error classes (Utils.retry_policy), DNS statuses and stage outcomes.
+    A record holds one of these instead of its own string.
+    """
+    NONE = 0
+    NXDOMAIN = 1
+    REFUSED = 2
+    TLS = 3
+    TIMEOUT = 4
+    NETWORK = 5
+    HTTP_4XX = 6
+    HTTP_5XX = 7
+    RATE_LIMITED = 8
+    INVALID = 9
+    UNKNOWN = 10
+    SERVFAIL = 11
+    NO_LOGO = 12
+
+    @classmethod
+    def of(cls, label: Optional[str]) -> "ErrorCode":
+        """
+        Code of an error class / DNS status string (None and "success" are NONE).
+        """
+        return _CODES.get(label, cls.UNKNOWN)
+
+    @property
+    def label(self) -> Optional[str]:
+        """
+        The error class string, as stored in the state store and the host registry.
+        """
+        return _LABELS[self]
+
+
+_CODES = {
+    None: ErrorCode.NONE,
+    "success": ErrorCode.NONE,
+    NXDOMAIN: ErrorCode.NXDOMAIN,
+    REFUSED: ErrorCode.REFUSED,
+    TLS: ErrorCode.TLS,
+    TIMEOUT: ErrorCode.TIMEOUT,
+    NETWORK: ErrorCode.NETWORK,
+    HTTP_4XX: ErrorCode.HTTP_4XX,
+    HTTP_5XX: ErrorCode.HTTP_5XX,
+    RATE_LIMITED: ErrorCode.RATE_LIMITED,
+    INVALID: ErrorCode.INVALID,
+    UNKNOWN: ErrorCode.UNKNOWN,
+    "error": ErrorCode.UNKNOWN,
+    "servfail": ErrorCode.SERVFAIL,
+    "no_logo": ErrorCode.NO_LOGO,
+}
+_LABELS = {code: label for label, code in _CODES.items() if label not in ("success", "error")}
+
+
+@dataclass(slots=True)
+class DomainRecord:
+    """
+    One canonical domain moving through the streaming pipeline.
+
+    Large fields only live as long as a stage needs them: the page body is dropped once the logo is extracted,
+    the logo bodies once the image is saved. The stage functions still take and return dicts, the record
+    builds them (as_pair, as_page, as_logo) and keeps only what the next stages use.
+    """
+    domain: str
+    resolved_ip: Optional[str] = None
+    ttl: Optional[int] = None
+    error: ErrorCode = ErrorCode.NONE
+    url: Optional[str] = None
+    html: Optional[str] = None
+    html_path: Optional[str] = None
+    extracted: bool = False
+    logo_url: Optional[str] = None
+    logo_bodies: Optional[Dict[str, bytes]] = None
+    image_path: Optional[str] = None
+
+    @classmethod
+    def from_resolved(cls, result: Dict[str, Any]) -> "DomainRecord":
+        """
+        Record of a resolve_stream() result.
+        """
+        return cls(result["domain"], result["resolved_ip"], result.get("ttl"), ErrorCode.of(result.get("status")))
+
+    def as_pair(self) -> Dict[str, Any]:
+        """
+        Input of Scraper.fetch().
+        """
+        return {"domain": self.domain, "resolved_ip": self.resolved_ip}
+
+    def as_page(self) -> Dict[str, Any]:
+        """
+        res_object for extract_site_logo().
+        """
+        return {"domain": self.domain, "success": True, "html": self.html, "url": self.url, "resolved_ip": self.resolved_ip, "logo_responses": self.logo_bodies}
+
+    def as_logo(self) -> Dict[str, Any]:
+        """
+        Input of LogoDownloader.download().
+        """
+        return {"domain": self.domain, "logo_url": self.logo_url, "resolved_ip": self.resolved_ip, "logo_responses": self.logo_bodies}
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        Entry of the resolved links output.
+        """
+        return {"domain": self.domain, "resolved_ip": self.resolved_ip, "status": self.error.label or "success", "ttl": self.ttl}
+
+    def fetched(self, res_object: Dict[str, Any]):
+        """
+        Keeps what the later stages need from a Scraper.fetch() result.
+        """
+        self.url = str(res_object["url"]) if res_object.get("url") else None
+        # A failure without a class (e.g. a headless render that failed) is still a failure.
+        self.error = ErrorCode.NONE if res_object["success"] else ErrorCode.of(res_object.get("error_class")) or ErrorCode.UNKNOWN
+        self.logo_bodies = res_object.get("logo_responses") or None
+        if "logo" in res_object:
+            # Integrated mode already extracted the logo, the body isn't needed anymore.
+            self.extracted = True
+            self.logo_url = res_object["logo"]["logo_url"] if res_object["logo"] else None
+        elif res_object["success"]:
+            self.html = res_object.get("html")
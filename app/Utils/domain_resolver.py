@@ -1,39 +1,155 @@
 import asyncio
-import socket
+import time
 import aiodns
-import httpcore
-from typing import List, Dict, Any, Tuple
-import httpx
+import aiodns.error
+from typing import AsyncIterator, List, Dict, Any, Optional
 
+from Utils.dns_cache import DNSCache
+from Utils.concurrency import AIMDLimiter
+from Utils.metrics import DOMAINS_IN, DOMAINS_OUT, FAILURES, IN_FLIGHT, LATENCY
 
-async def resolve_domain(domain: str, timeout=10) -> Dict[str, Any]:
-    resolver = aiodns.DNSResolver()
-    resolver.nameservers = ['8.8.8.8', '1.1.1.1']
-    # 8.8.8.8 -> Google DNS
-    # 1.1.1.1 -> Cloudflare DNS
+
+NAMESERVERS = ['8.8.8.8', '1.1.1.1']
+# 8.8.8.8 -> Google DNS
+# 1.1.1.1 -> Cloudflare DNS
+
+
+def create_resolvers(nameservers: List[str] = NAMESERVERS, timeout: float = 5) -> List[aiodns.DNSResolver]:
+    """
+    Creates one resolver per nameserver, meant to be shared by every lookup of a run.
+    Each nameserver is tried on its own, so a slow or failing one doesn't hide the other.
+    """
+    return [aiodns.DNSResolver(nameservers=[nameserver], timeout=timeout, tries=1) for nameserver in nameservers]
+
+
+def classify_dns_error(err: Exception) -> str:
+    """
+    Maps a resolution error to the status stored in the DNS cache.
+    """
+    if isinstance(err, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(err, aiodns.error.DNSError) and err.args:
+        code = err.args[0]
+        if code in (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA):
+            return "nxdomain"
+        if code == aiodns.error.ARES_ETIMEOUT:
+            return "timeout"
+        if code == aiodns.error.ARES_ESERVFAIL:
+            return "servfail"
+    return "error"
+
+
+async def resolve_domain(domain: str, resolvers: List[aiodns.DNSResolver], timeout=10) -> Dict[str, Any]:
+    """
+    Resolves a domain, trying each nameserver in turn.
+    NXDOMAIN is final. Timeouts, SERVFAIL and other errors move on to the next nameserver.
+    """
+    status = "error"
+    for resolver in resolvers:
+        try:
+            res = await asyncio.wait_for(
+                resolver.query(domain, "A"),
+                timeout=timeout
+            )
+            return {
+                "domain": domain,
+                "resolved_ip": res[0].host if res else None,
+                "status": "success" if res else "nxdomain",
+                "ttl": min(answer.ttl for answer in res) if res else None
+                }
+
+        except Exception as e:
+            status = classify_dns_error(e)
+            if status == "nxdomain":
+                break
+
+    print(f"Failed to resolve: {domain}. ({status})")
+    return {"domain": domain, "resolved_ip": None, "status": status}
+
+
+async def resolve_stream(domains: List[str], cache: Optional[DNSCache] = None, limiter: Optional[AIMDLimiter] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streams resolution results as they complete.
+
+    Cache hits are yielded first. Misses are fed continuously through the adaptive in-flight limit,
+    so one slow lookup only holds its own slot. Timeouts and SERVFAIL shrink the limit.
+
+    Args:
+        domains: List with unresolved domains.
+        cache: Optional DNS cache. Only missing or expired domains are queried, and the new answers
+               (failures included) are written back.
+        limiter: In-flight limiter of the resolve stage. A default one is used if none is given.
+    """
+    def counted(result: Dict[str, Any]) -> Dict[str, Any]:
+        if result["resolved_ip"] is not None:
+            DOMAINS_OUT.inc(stage="resolve", outcome="ok")
+        else:
+            DOMAINS_OUT.inc(stage="resolve", outcome="failed")
+            FAILURES.inc(stage="resolve", error_class=result["status"])
+        return result
+
+    DOMAINS_IN.inc(len(domains), stage="resolve")
+    if cache is not None:
+        hits, domains = cache.lookup(domains)
+        print(f"DNS cache hits: {len(hits)}")
+        for hit in hits:
+            yield counted(hit)
+
+    if not domains:
+        return
+
+    limiter = limiter or AIMDLimiter("resolve", initial=100, minimum=10, maximum=1000)
+    resolvers = create_resolvers()
+    done = asyncio.Queue()
+    tasks = set()
+
+    async def resolve_bounded(domain: str):
+        result = {"domain": domain, "resolved_ip": None, "status": "error"}
+        started = time.monotonic()
+        IN_FLIGHT.inc(stage="resolve")
+        try:
+            result = await resolve_domain(domain, resolvers)
+        finally:
+            IN_FLIGHT.dec(stage="resolve")
+            LATENCY.observe(time.monotonic() - started, step="dns")
+            await limiter.release(time.monotonic() - started, congested=result["status"] in ("timeout", "servfail"))
+            await done.put(result)
+
+    async def feed():
+        for domain in domains:
+            await limiter.acquire()
+            task = asyncio.create_task(resolve_bounded(domain))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    feeder = asyncio.create_task(feed())
+    pending_writes = []
 
     try:
-        # res = await resolver.gethostbyname(domain, socket.AF_INET)
-        res = await asyncio.wait_for(
-            resolver.gethostbyname(domain, socket.AF_INET),
-            timeout=timeout
-        )
-        return {
-            "domain": domain,
-            "resolved_ip": res.addresses[0] if res.addresses else None,
-            "status": "success"
-            }
-    
-    except Exception as e:
-        print(f"Failed to resolve: {domain}. {e}")
-        return {"domain": domain, "resolved_ip": None}
-    
-async def resolve_all_domains(domains: List[str]) -> List[Dict[str, Any]]:
+        for _ in range(len(domains)):
+            result = await done.get()
+            pending_writes.append(result)
+            if cache is not None and len(pending_writes) >= 500:
+                cache.store(pending_writes)
+                pending_writes = []
+            yield counted(result)
+    finally:
+        feeder.cancel()
+        for task in list(tasks):
+            task.cancel()
+        if cache is not None:
+            cache.store(pending_writes)
+
+
+async def resolve_all_domains(domains: List[str], cache: Optional[DNSCache] = None, limiter: Optional[AIMDLimiter] = None) -> List[Dict[str, Any]]:
     """
     Resolving DNS to IPv4 for faster scraping.
-    
+
     Args:
         domains: List with unresolved domains.
+        cache: Optional DNS cache. Only missing or expired domains are queried, and the new answers
+               (failures included) are written back.
+        limiter: In-flight limiter of the resolve stage.
 
     Return
         res: List with IPv4 resolved domains.
@@ -42,26 +158,15 @@ async def resolve_all_domains(domains: List[str]) -> List[Dict[str, Any]]:
     total_domains = len(domains)
     print(f"Starting resolution for {total_domains}")
 
-    max_concurrent = 100
-    semaphore = asyncio.Semaphore(max_concurrent)
-
-    async def resolve_bounded(domain: str) -> Dict[str, Any]:
-        async with semaphore:
-            return await resolve_domain(domain)
-
-    # We'll process in batches to avoid overwhelming the system.
-    batch_size = 500
-    results = []
-    
-    for i in range(0, len(domains), batch_size):
-        batch = domains[i:i+batch_size]
-        batch_results = await asyncio.gather(
-            *(resolve_bounded(domain) for domain in batch),
-            return_exceptions=True
-        )
-
-        results.extend(batch_results)
-        await asyncio.sleep(1)
-
-    resolved_ips = [r for r in results if r["resolved_ip"] is not None] 
-    return resolved_ips
\ No newline at end of file
+    limiter = limiter or AIMDLimiter("resolve", initial=100, minimum=10, maximum=1000)
+    resolved_ips = []
+    completed = 0
+
+    async for result in resolve_stream(domains, cache, limiter):
+        completed += 1
+        if result["resolved_ip"] is not None:
+            resolved_ips.append(result)
+        if completed % 1000 == 0:
+            print(f"Resolved {completed}/{total_domains} (in flight: {limiter.in_flight}, limit: {limiter.limit})")
+
+    return resolved_ips
@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import time
+from typing import Optional
+
+from Utils.scrape_html import Scraper
+from Utils.parse_html import extract_site_logo
+from Utils.download_images import LogoDownloader
+from Utils.coalesce import Coalescer
+from Utils.domain_record import DomainRecord, ErrorCode
+from Utils.memory_budget import MemoryBudget, HTML, IMAGE, FEATURES, features_size
+from Utils.state_store import StateStore, FETCHED, EXTRACTED, DOWNLOADED, FEATURIZED, NO_LOGO
+from Utils.retry_policy import INVALID
+from Utils.metrics import DOMAINS_IN, DOMAINS_OUT, FAILURES, IN_FLIGHT, LATENCY
+from Analyzer.image_analyzer import ImageAnalyzer
+
+
+def tracked(stage: str):
+    """
+    Counts the domains entering and leaving a step (ok, failed, skipped after an earlier failure, error
+    when it raised), the failures by error class and the domains in flight.
+    """
+    def wrap(step):
+        @functools.wraps(step)
+        async def run(self, record: DomainRecord):
+            skipped = bool(record.error)
+            DOMAINS_IN.inc(stage=stage)
+            IN_FLIGHT.inc(stage=stage)
+            try:
+                result = await step(self, record)
+            except Exception:
+                DOMAINS_OUT.inc(stage=stage, outcome="error")
+                raise
+            finally:
+                IN_FLIGHT.dec(stage=stage)
+
+            if skipped:
+                DOMAINS_OUT.inc(stage=stage, outcome="skipped")
+            elif result is None or record.error:
+                DOMAINS_OUT.inc(stage=stage, outcome="failed")
+                FAILURES.inc(stage=stage, error_class=record.error.label or INVALID)
+                # Only feature extraction fails without an error code, on an image it can't read.
+            else:
+                DOMAINS_OUT.inc(stage=stage, outcome="ok")
+            return result
+        return run
+    return wrap
+
+
+class DomainSteps:
+    """
+    Per-domain steps after resolution: fetch -> extract -> download -> features, on DomainRecords.
+    The streaming pipeline runs them as stages, the refresh daemon one domain at a time.
+    Each step records its outcome in the state store, and the bytes it holds in the memory budget:
+    fetch (the source of new bytes) pauses while the budget is tight, the steps done with a body release it.
+    """
+
+    def __init__(self, state: StateStore, scraper: Scraper, downloader: LogoDownloader, logo_analyzer: ImageAnalyzer, parse_coalescer: Coalescer = None, budget: MemoryBudget = None):
+        self.state = state
+        self.scraper = scraper
+        self.downloader = downloader
+        self.logo_analyzer = logo_analyzer
+        self.parse_coalescer = parse_coalescer
+        self.budget = budget
+        self.failed = 0
+
+    @tracked("fetch")
+    async def fetch(self, record: DomainRecord) -> DomainRecord:
+        if self.budget is not None:
+            await self.budget.wait_for_room(record.domain)
+        started = time.monotonic()
+        res_object = await self.scraper.fetch(record.as_pair())
+        self.state.record(
+            record.domain, FETCHED, ok=res_object["success"], error_class=res_object.get("error_class"), error=res_object.get("error"),
+            seconds=time.monotonic() - started, page_url=str(res_object["url"]) if res_object.get("url") else None
+        )
+        if not res_object["success"]:
+            print(f"{record.domain}, ERR: {res_object['error']}\n SUCCESS: {res_object['success']}")
+        record.fetched(res_object)
+
+        if self.budget is not None:
+            html = record.html or ""
+            nbytes = len(html.encode("utf-8"))
+            # Bytes, not characters: the size of the body as fetched and as spilled.
+            if self.budget.should_spill(nbytes):
+                record.html_path = self.budget.spill(html)
+                record.html = None
+            else:
+                self.budget.set(record.domain, HTML, nbytes)
+            self.budget.set(record.domain, IMAGE, sum(len(content) for content in (record.logo_bodies or {}).values()))
+        return record
+
+    @tracked("extract")
+    async def extract(self, record: DomainRecord) -> Optional[DomainRecord]:
+        if record.error:
+            self.failed += 1
+            if self.budget is not None:
+                self.budget.release(record.domain)
+            return None
+
+        started = time.monotonic()
+        if not record.extracted:
+            if record.html_path:
+                record.html = MemoryBudget.unspill(record.html_path)
+                record.html_path = None
+            logo = await extract_site_logo(record.as_page(), coalescer=self.parse_coalescer)
+            record.html = None
+            record.extracted = True
+            if logo is not None:
+                record.logo_url = logo["logo_url"]
+                record.logo_bodies = logo.get("logo_responses") or record.logo_bodies
+
+        self.state.record(
+            record.domain, EXTRACTED, ok=record.logo_url is not None, error_class=None if record.logo_url is not None else NO_LOGO,
+            seconds=time.monotonic() - started, logo_url=record.logo_url
+        )
+        if record.logo_url is None:
+            record.error = ErrorCode.NO_LOGO
+            if self.budget is not None:
+                self.budget.release(record.domain)
+            return None
+        if self.budget is not None:
+            self.budget.release(record.domain, HTML)
+        return record
+
+    @tracked("download")
+    async def download(self, record: DomainRecord) -> Optional[DomainRecord]:
+        started = time.monotonic()
+        logo = record.as_logo()
+        downloaded = await self.downloader.download(logo)
+        record.logo_bodies = None
+        if downloaded is not None:
+            record.image_path = downloaded["path"]
+        else:
+            record.error = ErrorCode.of(logo.get("error_class"))
+        self.state.record(
+            record.domain, DOWNLOADED, ok=downloaded is not None, error_class=record.error.label,
+            seconds=time.monotonic() - started, image_path=record.image_path
+        )
+        if self.budget is not None:
+            self.budget.release(record.domain)
+        return record if downloaded is not None else None
+
+    @tracked("features")
+    async def features(self, record: DomainRecord):
+        started = time.monotonic()
+        features = await asyncio.to_thread(self.logo_analyzer.add_logo, record.image_path)
+        LATENCY.observe(time.monotonic() - started, step="features")
+        self.state.record(record.domain, FEATURIZED, ok=features is not None, error_class=None if features is not None else INVALID, seconds=time.monotonic() - started)
+        if self.budget is not None and features is not None:
+            self.budget.set(record.domain, FEATURES, features_size(features))
+        return features
@@ -2,9 +2,16 @@ from urllib.parse import urlparse, urljoin
 import urllib.parse
 from PIL import Image, ImageOps 
 from io import BytesIO
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from Utils.headers import headers_randomizer
+from Utils.politeness import PolitenessScheduler
+from Utils.concurrency import AIMDLimiter, polite_wait
+from Utils.retry_policy import DeferredRetryQueue, INVALID, retry_delay, REFUSED, UNKNOWN, classify_exception, classify_status
+from Utils.host_registry import HostRegistry
+from Utils.coalesce import Coalescer
+from Utils.metrics import BYTES, LATENCY
+from config import COALESCE_MAX_BYTES
 
 import aiohttp
 import os
@@ -12,9 +19,8 @@ import asyncio
 import re
 import base64
 import logging
-import cairosvg
 import ssl
-import random
+import time
 
 
 # logging.basicConfig(level=logging.DEBUG)
@@ -83,6 +89,7 @@ def resize_with_ar(img: Image.Image, target_size: tuple) -> Image.Image:
     """
     Resizes the image, containing the aspect ratio and handling transparency.
     """
+    started = time.monotonic()
     try:
         if img.mode in ("RGBA", "LA", "P"):
             if img.mode == "P" and "transparency" in img.info:
@@ -114,6 +121,8 @@ def resize_with_ar(img: Image.Image, target_size: tuple) -> Image.Image:
     except Exception as err:
         print(f"Error resizing the image. ERR: {err}")
         return img
+    finally:
+        LATENCY.observe(time.monotonic() - started, step="resize")
 
 def filename_sanitizer(domain: str) -> str:
 
@@ -141,29 +150,32 @@ def svg_conversion(svg_bytes: bytes, size=(128, 128)) -> bytes :
     SVGs cannot be converted to perceptual hashes.
     
     """
-    
-    try:
-        png_bytes = cairosvg.svg2png(
-            bytestring=svg_bytes,
-            output_width=size[0],
-            output_height=size[1],
-            background_color="white" 
-        )
-    except Exception as err:
-        print(f"Error converting svg to .png. ERR: {err}")
+    import cairosvg
+    # Loaded on the first SVG logo only (it also needs the native cairo library).
 
-        # Trying without background color.
-        try: 
+    with LATENCY.time(step="svg"):
+        try:
             png_bytes = cairosvg.svg2png(
                 bytestring=svg_bytes,
                 output_width=size[0],
-                output_height=size[1]
+                output_height=size[1],
+                background_color="white" 
             )
-        except Exception as err2:
-            print(f"Error converting .svg on second try. {err2}")
-            raise err2
+        except Exception as err:
+            print(f"Error converting svg to .png. ERR: {err}")
+
+            # Trying without background color.
+            try: 
+                png_bytes = cairosvg.svg2png(
+                    bytestring=svg_bytes,
+                    output_width=size[0],
+                    output_height=size[1]
+                )
+            except Exception as err2:
+                print(f"Error converting .svg on second try. {err2}")
+                raise err2
     
-    return png_bytes
+        return png_bytes
 
 
 def is_svg_content(content: bytes) -> bool:
@@ -186,8 +198,14 @@ def is_valid_content(content: bytes) -> bool:
 
 
 
-async def try_alternative_protocols(logo_url: str, domain: str, session: aiohttp.ClientSession, headers: dict):
-    """Try both HTTPS and HTTP if one fails"""
+async def try_alternative_protocols(logo_url: str, domain: str, session: aiohttp.ClientSession, headers: dict, scheduler: Optional[PolitenessScheduler] = None, ip: Optional[str] = None, limiter: Optional[AIMDLimiter] = None, registry: Optional[HostRegistry] = None):
+    """Try both HTTPS and HTTP if one fails. Returns (content, url, error_class).
+    With a host registry, the known-good scheme goes first, a known-bad one is skipped,
+    and TLS verification is skipped right away on hosts where it failed before."""
+    host = urlparse(logo_url).hostname or domain
+    if host not in (domain, f"www.{domain}"):
+        ip = None
+        # The domain's IP only says something about logos hosted on the domain itself.
     urls_to_try = []
     
     if logo_url.startswith('https://'):
@@ -198,14 +216,23 @@ async def try_alternative_protocols(logo_url: str, domain: str, session: aiohttp
         urls_to_try.append(logo_url.replace('http://', 'https://'))
     else:
         urls_to_try.append(logo_url)
+
+    if registry is not None and len(urls_to_try) > 1:
+        schemes = registry.schemes(host)
+        urls_to_try = sorted((url for url in urls_to_try if urlparse(url).scheme in schemes), key=lambda url: schemes.index(urlparse(url).scheme))
     
+    error_class = None
     for url in urls_to_try:
+        scheme = urlparse(url).scheme
         try:
             # Try with SSL verification first, then without
-            ssl_configs = [True, False]
+            ssl_configs = [True, False] if registry is None or registry.verify_tls(host) else [False]
             
             for ssl_verify in ssl_configs:
                 try:
+                    if scheduler is not None:
+                        await polite_wait(scheduler, host, ip)
+                    started = time.monotonic()
                     async with session.get(
                         url,
                         headers=headers,
@@ -215,26 +242,72 @@ async def try_alternative_protocols(logo_url: str, domain: str, session: aiohttp
                     ) as res:
                         if res.status == 200:
                             content = await res.read()
+                            BYTES.inc(len(content), kind="logo")
+                            # Same span as fetch_logo's: one request, from its start (past the politeness wait) to the body read.
+                            LATENCY.observe(time.monotonic() - started, step="download")
                             if is_valid_content(content):
-                                return content, url
+                                if registry is not None:
+                                    registry.record(host, **{scheme: "ok"})
+                                return content, url, None
+                            error_class = INVALID
+                            break
                         elif res.status in [301, 302, 303, 307, 308]:
                             # Handle redirects manually if needed
                             continue
-                except (ssl.SSLError, aiohttp.ClientSSLError):
+                        elif res.status in (429, 503) and limiter is not None:
+                            limiter.signal_congestion()
+                        error_class = classify_status(res.status) or UNKNOWN
+                        break  # Same answer without SSL verification, try next URL
+                except (ssl.SSLError, aiohttp.ClientSSLError) as err:
+                            error_class = classify_exception(err)
+                            if registry is not None:
+                                registry.record(host, **({"tls_verify": False} if ssl_verify else {scheme: "fail"}))
                             if ssl_verify:
                                 continue  # Try without SSL verification
                             else:
                                 break  # Both SSL configs failed
-                except (aiohttp.ClientError, asyncio.TimeoutError):
+                except (aiohttp.ServerDisconnectedError, aiohttp.ServerTimeoutError, asyncio.TimeoutError) as err:
+                    error_class = classify_exception(err)
+                    if limiter is not None:
+                        limiter.signal_congestion()
                     break  # Try next URL
-        except Exception:
+                except aiohttp.ClientError as err:
+                    error_class = classify_exception(err)
+                    if registry is not None and error_class == REFUSED:
+                        registry.record(host, **{scheme: "fail"})
+                    break  # Try next URL
+        except Exception as err:
+            error_class = classify_exception(err)
             continue
     
-    return None, None
+    return None, None, error_class or UNKNOWN
 
-async def download_img(logo_href: str, domain: str, session: aiohttp.ClientSession, img_size=(128, 128), output_file_path="", retries=3):
+def find_prefetched(logo_url: str, prefetched: Optional[Dict[str, bytes]]) -> Optional[bytes]:
+    """
+        Looks up a logo among the image responses captured by the headless browser.
+        Falls back to matching the path, for hrefs resolved against the domain because the final page URL wasn't known.
+    """
+    if not prefetched:
+        return None
+    if logo_url in prefetched:
+        return prefetched[logo_url]
+
+    logo_path = urlparse(logo_url).path
+    for url, content in prefetched.items():
+        if logo_path and urlparse(url).path == logo_path:
+            return content
+    return None
+
+
+async def download_img(logo_href: str, domain: str, session: aiohttp.ClientSession, img_size=(128, 128), output_file_path="", prefetched: Optional[Dict[str, bytes]] = None, scheduler: Optional[PolitenessScheduler] = None, ip: Optional[str] = None, limiter: Optional[AIMDLimiter] = None, registry: Optional[HostRegistry] = None, coalescer: Optional[Coalescer] = None):
     """
         Image downloader logic.
+        prefetched: image bodies captured while rendering the page, keyed by URL. A match skips the download.
+        scheduler, ip: politeness scheduler and the domain's resolved IP, deciding when each request may start.
+        limiter: adaptive limiter of the download stage, told about timeouts, disconnects and 429/503.
+        registry: host capability registry shared with the scraper (schemes, TLS verification).
+        coalescer: shares downloads by absolute logo URL, domains using the same (CDN) logo fetch it once.
+        A failed download returns {"domain", "logo_url", "error_class"} instead of retrying in place.
     """
     sanitized_domain = filename_sanitizer(domain)
 
@@ -267,6 +340,7 @@ async def download_img(logo_href: str, domain: str, session: aiohttp.ClientSessi
                     "domain": domain,
                     "logo_url": logo_url,
                     "size": os.path.getsize(file_path),
+                    "path": file_path,
                 }
             except Exception as err:
                 print(f"Error processing inline SVG for {domain}: {err}")
@@ -311,33 +385,32 @@ async def download_img(logo_href: str, domain: str, session: aiohttp.ClientSessi
                     "domain": domain,
                     "logo_url": logo_url,
                     "size": os.path.getsize(file_path),
+                    "path": file_path,
                 }
             except Exception as e:
                 print(f"Error processing data:image for {domain}: {e}")
                 return None
                 
         headers = headers_randomizer(domain)
-      
-        # Try downloading with multiple strategies
-        for attempt in range(retries + 1):
-            try:
-                if attempt > 0:
-                    delay = min(2 ** attempt + random.uniform(0, 1), 10)
-                    await asyncio.sleep(delay)
-                
-                content, final_url = await try_alternative_protocols(logo_url, domain, session, headers)
-                
-                if content is not None:
-                    break
-                    
-            except Exception as e:
-                if attempt == retries:
-                    print(f"All attempts failed for {domain}: {e}")
-                    return None
-                continue
-        
+        content = find_prefetched(logo_url, prefetched)
+        if content is not None and not is_valid_content(content):
+            content = None
+            # Not an image after all (error page, HTML placeholder), download it for real.
+        final_url = logo_url if content is not None else None
+
         if content is None:
-            return None
+            # Single attempt, the caller defers a retry depending on the error class.
+            download = lambda: try_alternative_protocols(logo_url, domain, session, headers, scheduler, ip, limiter, registry)
+            if coalescer is not None:
+                (content, final_url, error_class), _ = await coalescer.run(logo_url, download)
+            else:
+                content, final_url, error_class = await download()
+            if content is None:
+                return {
+                    "domain": domain,
+                    "logo_url": logo_url,
+                    "error_class": error_class,
+                }
         
         if not is_valid_content(content):
             return None
@@ -362,6 +435,7 @@ async def download_img(logo_href: str, domain: str, session: aiohttp.ClientSessi
                 "domain": domain,
                 "logo_url": final_url or logo_url,
                 "size": os.path.getsize(file_path),
+                "path": file_path,
             }
         
         except Exception as err:
@@ -373,76 +447,146 @@ async def download_img(logo_href: str, domain: str, session: aiohttp.ClientSessi
         return None
 
 
-async def image_downloader(logo_urls: List[Dict[str, str]], output_file_path=""):
-    
-    print(f"\nDownloading {len(logo_urls)} images...\n")
+class LogoDownloader:
+    """
+    The download session and the state shared by every logo (scheduler, limiter, registry, coalescer).
 
-    os.makedirs(output_file_path, exist_ok=True)
-    batch_size = 100 
-    
-    connector = aiohttp.TCPConnector(
-        limit=15,  
-        limit_per_host=3,
-        ssl=False, 
-        enable_cleanup_closed=True,
-        ttl_dns_cache=300,
-        use_dns_cache=True,
-        keepalive_timeout=30,
-        family=0, 
-    )
-    
-    timeout = aiohttp.ClientTimeout(
-        total=25,
-        connect=8,
-        sock_read=10
-    ) 
+    image_downloader drives it over a list with deferred retry passes; the streaming pipeline calls download()
+    one logo at a time.
 
+    async with LogoDownloader(IMG_PATH) as downloader:
+        result = await downloader.download(pair)
+    """
+
+    def __init__(self, output_file_path="", scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, registry: Optional[HostRegistry] = None):
+        self.output_file_path = output_file_path
+        self.scheduler = scheduler or PolitenessScheduler()
+        self.limiter = limiter or AIMDLimiter("download", initial=15, minimum=5, maximum=500)
+        self.registry = registry
+        self.coalescer = Coalescer(max_completed=2000, keep=lambda result: result[0] is not None, size=lambda result: len(result[0]), max_bytes=COALESCE_MAX_BYTES)
+        self.session = None
+
+    async def start(self):
+        os.makedirs(self.output_file_path, exist_ok=True)
+        connector = aiohttp.TCPConnector(
+            limit=self.limiter.maximum,
+            limit_per_host=3,
+            ssl=False, 
+            enable_cleanup_closed=True,
+            ttl_dns_cache=300,
+            use_dns_cache=True,
+            keepalive_timeout=30,
+            family=0, 
+        )
+        
+        timeout = aiohttp.ClientTimeout(
+            total=25,
+            connect=8,
+            sock_read=10
+        ) 
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+        )
+
+    async def close(self):
+        print(f"Coalesced logo downloads: {self.coalescer.snapshot()}")
+        await self.session.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def attempt(self, pair: Dict[str, str]):
+        async with self.limiter.slot():
+            return await download_img(
+                pair["logo_url"], pair["domain"], self.session,
+                output_file_path=self.output_file_path,
+                prefetched=pair.get("logo_responses"),
+                scheduler=self.scheduler,
+                ip=pair.get("resolved_ip"),
+                limiter=self.limiter,
+                registry=self.registry,
+                coalescer=self.coalescer
+            )
+
+    async def download(self, pair: Dict[str, str]):
+        """
+        Downloads one logo, retrying after the error class's delay (no slot held while waiting).
+        Returns the download_img result, or None if it failed for good (its error class is then left in pair["error_class"]).
+        """
+        attempt = 1
+        while True:
+            try:
+                result = await self.attempt(pair)
+            except Exception as err:
+                print(f"Generic error for {pair['domain']}: {err}")
+                pair["error_class"] = UNKNOWN
+                return None
+            if result is None:
+                pair["error_class"] = INVALID
+                return None
+            if "error_class" not in result:
+                return result
+
+            delay = retry_delay(result["error_class"], attempt)
+            if delay is None:
+                pair["error_class"] = result["error_class"]
+                return None
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+async def image_downloader(logo_urls: List[Dict[str, str]], output_file_path="", scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, registry: Optional[HostRegistry] = None):
+
+    print(f"\nDownloading {len(logo_urls)} images...\n")
+
+    batch_size = 1000
     all_downloaded = []
     failed_count = 0
     
-    async with aiohttp.ClientSession(
-        connector=connector,
-        timeout=timeout,
-        ) as client:
-
-        for i in range(0, len(logo_urls), batch_size):
-            batch = logo_urls[i:i+batch_size]
-            batch_num = i//batch_size + 1
-            total_batches = (len(logo_urls) + batch_size - 1)//batch_size
-            
-            print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} items)")
-            
-            tasks = [
-                download_img(pair["logo_url"], pair["domain"], client, output_file_path=output_file_path)
-                for pair in batch
-            ]
-            
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            batch_downloaded = []
-            batch_failed = 0
-            
-            for r in batch_results:
-                if isinstance(r, Exception):
-                    batch_failed += 1
-                elif r is not None:
-                    batch_downloaded.append(r)
-                else:
-                    batch_failed += 1
-            
-            all_downloaded.extend(batch_downloaded)
-            failed_count += batch_failed
-            
-            success_rate = (len(all_downloaded) / (i + len(batch))) * 100
-            print(f"Batch {batch_num} completed: {len(batch_downloaded)}/{len(batch)} successful")
-            print(f"Overall progress: {len(all_downloaded)}/{i + len(batch)} ({success_rate:.1f}% success rate)")
-            
-            if success_rate < 20:
-                await asyncio.sleep(2)
-            elif success_rate < 50:
-                await asyncio.sleep(1)
-            else:
-                await asyncio.sleep(0.5)
+    async with LogoDownloader(output_file_path, scheduler=scheduler, limiter=limiter, registry=registry) as downloader:
+        limiter = downloader.limiter
+
+        retry_queue = DeferredRetryQueue()
+        pending = [(pair, 1) for pair in logo_urls]
+        done = 0
+
+        # Failed downloads wait in the retry queue (backoff depends on the error class)
+        # and are tried again in a later pass, without holding a download slot meanwhile.
+        while pending:
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i+batch_size]
+                
+                print(f"Processing {len(batch)} downloads ({len(retry_queue)} deferred)")
+
+                tasks = [downloader.attempt(pair) for pair, _ in batch]
+                
+                batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+                
+                batch_downloaded = []
+                batch_failed = 0
+                
+                for (pair, attempt), r in zip(batch, batch_results):
+                    if isinstance(r, Exception) or r is None:
+                        batch_failed += 1
+                    elif "error_class" in r:
+                        if not retry_queue.defer(pair, r["error_class"], attempt):
+                            batch_failed += 1
+                    else:
+                        batch_downloaded.append(r)
+                
+                all_downloaded.extend(batch_downloaded)
+                failed_count += batch_failed
+                done += len(batch_downloaded) + batch_failed
+                
+                success_rate = (len(all_downloaded) / max(done, 1)) * 100
+                print(f"Batch completed: {len(batch_downloaded)}/{len(batch)} successful")
+                print(f"Overall progress: {len(all_downloaded)}/{done} ({success_rate:.1f}% success rate, in flight limit: {limiter.limit})")
 
+            pending = await retry_queue.next_pass()
 
-    return all_downloaded
\ No newline at end of file
+    return all_downloaded
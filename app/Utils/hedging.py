@@ -0,0 +1,113 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+
+class RequestProgress:
+    """
+    Handed to the primary request of a race: it sets `sent` once the request actually goes out
+    (past any politeness wait) and `headers` when the response headers arrive.
+    """
+
+    __slots__ = ("sent", "headers")
+
+    def __init__(self):
+        self.sent = asyncio.Event()
+        self.headers = asyncio.Event()
+
+
+class Hedger:
+    """
+    Hedged requests: when a request is slower than a recent latency percentile,
+    a backup request is started and whichever succeeds first wins (the other one is cancelled).
+
+    The delay tracks the `percentile` of the last `window` response latencies, clamped to
+    [min_delay, max_delay]; until `min_samples` latencies are known, max_delay is used.
+    At most `max_ratio` of the requests are hedged, so a slow period can't double the load.
+    """
+
+    def __init__(self, percentile: float = 95, min_delay: float = 0.5, max_delay: float = 5.0,
+                 max_ratio: float = 0.1, window: int = 1000, min_samples: int = 50):
+        """
+        Params:
+            percentile: Latency percentile (0-100) after which a request gets a backup.
+            min_delay, max_delay: Bounds of the hedge delay (s).
+            max_ratio: Maximum share of hedged requests.
+            window: Number of recent latencies kept.
+            min_samples: Latencies needed before the percentile is trusted.
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.backup_wins = 0
+
+    def record(self, latency: float):
+        self.latencies.append(latency)
+
+    def delay(self) -> float:
+        if len(self.latencies) < self.min_samples:
+            return self.max_delay
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return min(self.max_delay, max(self.min_delay, ordered[index]))
+
+    def allow(self) -> bool:
+        return self.hedged < self.max_ratio * self.requests
+
+    async def _until(self, first: asyncio.Task, event: asyncio.Event, timeout: Optional[float] = None) -> bool:
+        # Whether the event was set (or the request finished) within timeout.
+        waiter = asyncio.ensure_future(event.wait())
+        try:
+            done, _ = await asyncio.wait({first, waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            return bool(done)
+        finally:
+            waiter.cancel()
+
+    async def race(self, primary: Callable[[RequestProgress], Awaitable[Any]], backup: Callable[[], Awaitable[Any]],
+                   is_success: Callable[[Any], bool], can_hedge: Callable[[], bool] = lambda: True) -> Tuple[Any, bool]:
+        """
+        Runs primary(progress), and backup() too if primary's response headers haven't arrived delay() after
+        its request went out. The delay is a header latency percentile, so the politeness wait before the
+        request and the body read after the headers aren't timed. can_hedge() is asked right before the backup
+        starts (e.g. not while its host is being throttled).
+        Returns (result, hedged). The first successful result wins; if both fail, the primary's result is returned.
+        Neither callable should raise.
+        """
+        self.requests += 1
+        progress = RequestProgress()
+        first = asyncio.create_task(primary(progress))
+        await self._until(first, progress.sent)
+        if await self._until(first, progress.headers, self.delay()) or not self.allow() or not can_hedge():
+            return await first, False
+
+        self.hedged += 1
+        second = asyncio.create_task(backup())
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if is_success(task.result()):
+                        if task is second:
+                            self.backup_wins += 1
+                        return task.result(), True
+            return first.result(), True
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def snapshot(self):
+        return {
+            "delay": self.delay(),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "backup_wins": self.backup_wins,
+        }
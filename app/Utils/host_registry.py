@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+SCHEMES = ("https", "http")
+
+# Fact values that hold a host back (scheme skipped, no TLS verification, no HTTP/2, headless only).
+NEGATIVE = {"https": "fail", "http": "fail", "tls_verify": False, "http2": False, "headless": True}
+
+
+class HostRegistry:
+    """
+    Per-host facts learned from observed outcomes, shared by the scraper and the downloader
+    and kept between runs in SQLite.
+
+    For each host:
+        https / http: "ok" or "fail" (connection level: TLS, refused), None if unknown.
+        tls_verify: False once a certificate failed verification (the downloader then skips verification).
+        http2: Whether HTTP/2 was negotiated; False as well after an HTTP/2 protocol error.
+        headless: True when only the headless browser got the page, False when plain HTTP did.
+
+    Every fact has its own timestamp and is forgotten max_age after it, so hosts get re-probed now and then.
+    Recording the same negative fact again keeps its first timestamp: a host held back by it isn't
+    probed the normal way, so seeing it again says nothing new.
+    """
+
+    def __init__(self, path: str, max_age: int = 30 * 86400, flush_every: int = 200):
+        """
+        Params:
+            path: SQLite database file. Created if missing.
+            max_age: Seconds after which a fact is dropped.
+            flush_every: Number of buffered fact updates committed in one transaction.
+        """
+        self.path = path
+        self.max_age = max_age
+        self.flush_every = flush_every
+        # host -> fact -> (value, updated_at)
+        self.hosts: Dict[str, Dict[str, Tuple[Any, float]]] = {}
+        self._pending: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        # Shard processes share the file, wait for each other's write transactions.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS host_facts (
+                host TEXT NOT NULL,
+                fact TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (host, fact)
+            )
+            """
+        )
+        self.conn.commit()
+        self.load()
+
+    def load(self):
+        cutoff = time.time() - self.max_age
+        with self.conn:
+            self.conn.execute("DELETE FROM host_facts WHERE updated_at < ?", (cutoff,))
+        for host, fact, value, updated_at in self.conn.execute("SELECT host, fact, value, updated_at FROM host_facts"):
+            self.hosts.setdefault(host, {})[fact] = (json.loads(value), updated_at)
+
+    def flush(self):
+        """
+        Upserts the buffered facts. A fact another shard process wrote more recently is kept.
+        """
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO host_facts (host, fact, value, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(host, fact) DO UPDATE SET
+                    value=excluded.value,
+                    updated_at=excluded.updated_at
+                WHERE excluded.updated_at >= host_facts.updated_at
+                """,
+                [(host, fact, json.dumps(value), updated_at) for (host, fact), (value, updated_at) in self._pending.items()]
+            )
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def get(self, host: str) -> Dict[str, Any]:
+        cutoff = time.time() - self.max_age
+        return {fact: value for fact, (value, updated_at) in self.hosts.get(host.lower(), {}).items() if updated_at >= cutoff}
+
+    def record(self, host: str, **facts):
+        """
+        registry.record("example.com", https="ok", http2=True)
+        """
+        if not host:
+            return
+        host = host.lower()
+        entry = self.hosts.setdefault(host, {})
+        now = time.time()
+        for fact, value in facts.items():
+            known = entry.get(fact)
+            if known is not None and known[0] == value and NEGATIVE.get(fact) == value and now - known[1] < self.max_age:
+                continue
+            entry[fact] = self._pending[(host, fact)] = (value, now)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def schemes(self, host: str) -> List[str]:
+        """
+        Schemes to try, known-good first. A scheme known to fail is dropped if the other one is known to work.
+        """
+        facts = self.get(host)
+        ordered = sorted(SCHEMES, key=lambda scheme: {"ok": 0, None: 1, "fail": 2}[facts.get(scheme)])
+        if facts.get(ordered[0]) == "ok":
+            ordered = [scheme for scheme in ordered if facts.get(scheme) != "fail"]
+        return ordered
+
+    def verify_tls(self, host: str) -> bool:
+        return self.get(host).get("tls_verify") is not False
+
+    def http2(self, host: str) -> Optional[bool]:
+        return self.get(host).get("http2")
+
+    def needs_headless(self, host: str) -> bool:
+        return self.get(host).get("headless") is True
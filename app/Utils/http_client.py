@@ -0,0 +1,162 @@
+import asyncio
+import ssl
+import time
+import httpcore
+import httpx
+from typing import Any, Dict, Optional, Tuple
+
+from Utils.metrics import LATENCY
+
+
+class _WarmStream(httpcore.AsyncNetworkStream):
+    """
+    TLS stream opened ahead of time by PinnedNetworkBackend.preconnect.
+    The handshake already happened, so start_tls hands back the TLS stream as is.
+    """
+
+    def __init__(self, stream: httpcore.AsyncNetworkStream):
+        self._stream = stream
+
+    async def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        return await self._stream.read(max_bytes, timeout)
+
+    async def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        await self._stream.write(buffer, timeout)
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+    async def start_tls(self, ssl_context: ssl.SSLContext, server_hostname: Optional[str] = None, timeout: Optional[float] = None) -> httpcore.AsyncNetworkStream:
+        return self._stream
+
+    def get_extra_info(self, info: str) -> Any:
+        return self._stream.get_extra_info(info)
+
+
+class PinnedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend that connects to already resolved IPs.
+
+    Only the TCP destination changes: httpcore still sends the hostname as SNI and in the Host header.
+    It can also open TCP + TLS connections ahead of time (preconnect), which are handed over
+    to the first request for that host.
+    """
+
+    def __init__(self, ssl_context: Optional[ssl.SSLContext] = None, warm_ttl: float = 10.0, max_warm: int = 200, max_preconnects: int = 50, pins: Optional[Dict[str, str]] = None):
+        """
+        Params:
+            ssl_context: Context used for the preconnect handshakes. Must be the client's context
+                (its ALPN protocols decide whether a warm stream speaks HTTP/2).
+            warm_ttl: Seconds a preconnected stream is kept before it is considered stale.
+            max_warm: Maximum number of idle preconnected streams.
+            max_preconnects: Maximum number of handshakes running at the same time.
+            pins: host -> IP dict, to share the pins with another backend.
+        """
+        self._backend = httpcore.AnyIOBackend()
+        self.ssl_context = ssl_context
+        self.warm_ttl = warm_ttl
+        self.max_warm = max_warm
+        self.pins: Dict[str, str] = {} if pins is None else pins
+
+        self._warm: Dict[Tuple[str, int], Tuple[httpcore.AsyncNetworkStream, float]] = {}
+        self._pending: Dict[Tuple[str, int], asyncio.Task] = {}
+        self._preconnect_sem = asyncio.Semaphore(max_preconnects)
+
+    def pin(self, host: str, ip: Optional[str]):
+        if host and ip:
+            self.pins[host] = ip
+
+    async def unpin(self, host: str):
+        """
+        Forgets a host once its requests are done. A stream still warm for it is closed.
+        """
+        self.pins.pop(host, None)
+        for key in [key for key in self._warm if key[0] == host]:
+            stream, _ = self._warm.pop(key)
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None, local_address: Optional[str] = None, socket_options=None) -> httpcore.AsyncNetworkStream:
+        key = (host, port)
+        pending = self._pending.get(key)
+        if pending is not None:
+            await asyncio.wait({pending}, timeout=timeout)
+
+        warm = self._warm.pop(key, None)
+        if warm is not None:
+            stream, created = warm
+            if time.monotonic() - created < self.warm_ttl:
+                return stream
+            await stream.aclose()
+
+        # Only new TCP connections are timed, a warm stream took no connect time for this request.
+        with LATENCY.time(step="connect"):
+            return await self._backend.connect_tcp(
+                self.pins.get(host, host),
+                port,
+                timeout=timeout,
+                local_address=local_address,
+                socket_options=socket_options
+            )
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None, socket_options=None) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+    def preconnect(self, host: str, port: int = 443, timeout: float = 5.0):
+        """
+        Starts a TCP + TLS handshake (TCP only on port 80) to a pinned host in the background.
+        Does nothing if the host isn't pinned, a stream is already warm / pending, or the warm pool is full.
+        """
+        key = (host, port)
+        if host not in self.pins or key in self._warm or key in self._pending:
+            return
+        if len(self._warm) + len(self._pending) >= self.max_warm:
+            return
+
+        task = asyncio.create_task(self._preconnect(key, timeout))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def _preconnect(self, key: Tuple[str, int], timeout: float):
+        host, port = key
+        try:
+            async with self._preconnect_sem:
+                stream = await self._backend.connect_tcp(self.pins[host], port, timeout=timeout)
+                if port == 80:
+                    self._warm[key] = (stream, time.monotonic())
+                    return
+                    # Plain http, httpcore doesn't call start_tls on it.
+                try:
+                    stream = await stream.start_tls(self.ssl_context or ssl.create_default_context(), server_hostname=host, timeout=timeout)
+                except Exception:
+                    await stream.aclose()
+                    raise
+                self._warm[key] = (_WarmStream(stream), time.monotonic())
+        except Exception:
+            pass
+            # The request opens its own connection and reports the real error.
+
+    async def aclose(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+        for stream, _ in list(self._warm.values()):
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
+        self._warm.clear()
+
+
+def create_pinned_transport(backend: PinnedNetworkBackend, **kwargs) -> httpx.AsyncHTTPTransport:
+    """
+    Creates an httpx transport whose connections go through the pinned backend.
+    httpx doesn't expose the network backend, so it's set on the underlying httpcore pool.
+    """
+    transport = httpx.AsyncHTTPTransport(**kwargs)
+    transport._pool._network_backend = backend
+    return transport
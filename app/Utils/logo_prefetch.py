@@ -0,0 +1,86 @@
+import time
+import httpx
+from typing import Any, Dict, Optional
+from urllib.parse import urljoin, urlparse
+
+from Utils.headers import headers_randomizer
+from Utils.parse_html import extract_site_logo
+from Utils.politeness import PolitenessScheduler
+from Utils.concurrency import AIMDLimiter, polite_wait
+from Utils.coalesce import Coalescer
+from Utils.metrics import BYTES, LATENCY
+from config import LOGO_MAX_BYTES
+
+
+async def fetch_logo(client: httpx.AsyncClient, logo_url: str, domain: str, ip: Optional[str] = None, scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, max_bytes: int = LOGO_MAX_BYTES) -> Optional[bytes]:
+    """
+    Downloads a logo body with the scraper's client. Returns None on any failure,
+    the downloader then tries again on its own.
+    """
+    host = urlparse(logo_url).hostname or domain
+    try:
+        if scheduler is not None:
+            await polite_wait(scheduler, host, ip if host in (domain, f"www.{domain}") else None)
+        started = time.monotonic()
+        async with client.stream("GET", logo_url, headers=headers_randomizer(domain), timeout=httpx.Timeout(15.0, connect=8.0), follow_redirects=True) as res:
+            if res.status_code != 200:
+                if limiter is not None and res.status_code in (429, 503):
+                    limiter.signal_congestion()
+                return None
+
+            content = bytearray()
+            async for chunk in res.aiter_bytes():
+                content += chunk
+                BYTES.inc(len(chunk), kind="logo")
+                if len(content) > max_bytes:
+                    print(f"Logo too large on domain {domain}: {logo_url}")
+                    return None
+            LATENCY.observe(time.monotonic() - started, step="download")
+            return bytes(content)
+    except httpx.TimeoutException:
+        if limiter is not None:
+            limiter.signal_congestion()
+    except Exception as err:
+        print(f"Error prefetching logo {logo_url} for {domain}. ERR: {err}")
+    return None
+
+
+async def prefetch_logo(client: httpx.AsyncClient, res_object: Dict[str, Any], scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, parse_coalescer: Optional[Coalescer] = None, logo_coalescer: Optional[Coalescer] = None) -> Dict[str, Any]:
+    """
+    Integrated mode: extracts the logo right after the page was fetched and downloads it on the same
+    client, while the connection to the host is still warm (same-host logos skip DNS, TCP and TLS).
+
+    The extracted logo is kept in res_object["logo"] (None if there is none), and its body in
+    res_object["logo_responses"], so the logo stage neither parses the page again nor downloads it again.
+    parse_coalescer / logo_coalescer share extractions by final page URL and bodies by absolute logo URL.
+    """
+    logo = await extract_site_logo(res_object, coalescer=parse_coalescer)
+    res_object["logo"] = logo
+    if logo is None:
+        return res_object
+
+    href = logo["logo_url"].strip()
+    if href.startswith(("data:", "<svg")) or res_object.get("logo_responses"):
+        return res_object
+        # Inline logos need no request, headless renders already captured the logo-looking images.
+
+    logo_url = urljoin(str(res_object.get("url") or f"https://{res_object['domain']}/"), href)
+    if urlparse(logo_url).scheme not in ("http", "https"):
+        return res_object
+
+    async def download() -> Optional[bytes]:
+        if limiter is None:
+            return await fetch_logo(client, logo_url, res_object["domain"], res_object.get("resolved_ip"), scheduler)
+        async with limiter.slot():
+            return await fetch_logo(client, logo_url, res_object["domain"], res_object.get("resolved_ip"), scheduler, limiter)
+
+    if logo_coalescer is not None:
+        content, _ = await logo_coalescer.run(logo_url, download)
+    else:
+        content = await download()
+
+    if content:
+        logo_responses = dict(logo.get("logo_responses") or {})
+        logo_responses[logo_url] = content
+        logo["logo_responses"] = res_object["logo_responses"] = logo_responses
+    return res_object
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+# Kinds of accounted memory. Features stay for grouping, the other kinds are in flight.
+HTML = "html"
+IMAGE = "image"
+FEATURES = "features"
+
+
+def features_size(features: Dict[str, Any]) -> int:
+    """
+    Approximate size (bytes) of one logo's feature dict: arrays plus per-value overhead.
+    """
+    return sum(getattr(value, "nbytes", 0) + 100 for value in features.values())
+
+
+class MemoryBudget:
+    """
+    Byte-accounted memory budget shared by the pipeline stages.
+
+    Page bodies, logo bodies and the feature vectors kept for grouping are counted per domain and kind.
+    The source stage (fetch) calls wait_for_room() before bringing in new domains and pauses while the in-flight
+    bytes are above the high-water mark of what the features leave of the limit; the later stages only consume,
+    and release the bytes when done with them (making them wait would stop the very stages that free memory).
+    Page bodies larger than spill_bytes go to temporary files while the budget is tight, and are read back when needed.
+    The files live in a directory of their own, emptied on start (bodies left there by a crashed run) and removed by close().
+    """
+
+    def __init__(self, limit_bytes: int, high_water: float = 0.85, spill_bytes: Optional[int] = None, spill_dir: Optional[str] = None, scope: str = "run"):
+        """
+        Params:
+            limit_bytes: Memory the accounted data may use.
+            high_water: Fraction of the limit left by the features above which in-flight bytes pause fetching.
+            spill_bytes: Page bodies at least this large are spilled to disk above the high-water mark (None disables spilling).
+            spill_dir: Where the spill directory goes (system temporary directory by default).
+            scope: Name of the spill directory. Budgets used at the same time (shards) need different ones.
+        """
+        self.limit_bytes = limit_bytes
+        self.high_water = high_water
+        self.high_water_bytes = int(limit_bytes * high_water)
+        self.spill_bytes = spill_bytes
+        self.spill_dir = os.path.join(spill_dir or tempfile.gettempdir(), f"logo-similarity-spill-{scope}")
+        self.used: Dict[str, int] = {HTML: 0, IMAGE: 0, FEATURES: 0}
+        self._held: Dict[Tuple[str, str], int] = {}
+        self._room = asyncio.Event()
+        self._room.set()
+
+        self.peak = 0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self.spilled = 0
+        self._warned = False
+
+        if spill_bytes is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def close(self):
+        """
+        Removes the spill directory, with the bodies no stage read back.
+        """
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    @property
+    def total(self) -> int:
+        return sum(self.used.values())
+
+    @property
+    def in_flight(self) -> int:
+        return self.used[HTML] + self.used[IMAGE]
+
+    @property
+    def in_flight_mark(self) -> int:
+        """
+        In-flight bytes above which fetching pauses: the high-water share of what the features leave free.
+        """
+        return int(max(self.limit_bytes - self.used[FEATURES], 0) * self.high_water)
+
+    @property
+    def tight(self) -> bool:
+        return self.in_flight >= self.in_flight_mark
+
+    def _update(self):
+        self.peak = max(self.peak, self.total)
+        # Features never drain, only in-flight bytes do, so with none left work goes on anyway.
+        if not self.tight or self.in_flight == 0:
+            self._room.set()
+        else:
+            self._room.clear()
+
+        if self.used[FEATURES] and self.used[FEATURES] >= self.high_water_bytes and not self._warned:
+            self._warned = True
+            print(f"Logo features alone use {self.used[FEATURES] / 2**20:.0f} MB, over the memory budget's high-water mark.")
+
+    def set(self, domain: str, kind: str, nbytes: int):
+        """
+        Sets the bytes a domain currently holds of a kind (0 releases them).
+        """
+        key = (domain, kind)
+        self.used[kind] += nbytes - self._held.get(key, 0)
+        if nbytes:
+            self._held[key] = nbytes
+        else:
+            self._held.pop(key, None)
+        self._update()
+
+    def release(self, domain: str, *kinds: str):
+        """
+        Releases the domain's bytes of the given kinds (its in-flight bytes by default).
+        """
+        for kind in kinds or (HTML, IMAGE):
+            self.set(domain, kind, 0)
+
+    def holds(self, domain: str) -> bool:
+        return (domain, HTML) in self._held or (domain, IMAGE) in self._held
+
+    async def wait_for_room(self, domain: Optional[str] = None):
+        """
+        Pauses while the in-flight bytes are above their mark. Only the source stage should call it;
+        a domain already holding in-flight bytes never waits, since finishing it is what frees memory.
+        """
+        if self._room.is_set() or (domain is not None and self.holds(domain)):
+            return
+        self.pauses += 1
+        started = time.monotonic()
+        await self._room.wait()
+        self.paused_seconds += time.monotonic() - started
+
+    def should_spill(self, nbytes: int) -> bool:
+        return self.spill_bytes is not None and nbytes >= self.spill_bytes and self.tight
+
+    def spill(self, content: str) -> str:
+        """
+        Writes a body to a temporary file and returns its path.
+        """
+        fd, path = tempfile.mkstemp(suffix=".html", dir=self.spill_dir)
+        with os.fdopen(fd, "w", encoding="utf-8", errors="replace") as f:
+            f.write(content)
+        self.spilled += 1
+        return path
+
+    @staticmethod
+    def unspill(path: str) -> str:
+        """
+        Reads a spilled body back and removes its file.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "used_mb": {kind: round(nbytes / 2**20, 1) for kind, nbytes in self.used.items()},
+            "peak_mb": round(self.peak / 2**20, 1),
+            "pauses": self.pauses,
+            "paused_seconds": round(self.paused_seconds, 1),
+            "spilled": self.spilled,
+        }
@@ -0,0 +1,244 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+# Latency buckets (seconds), from a cached DNS answer to a slow page or a big feature extraction.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(names: Tuple[str, ...], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    if set(labels) != set(names):
+        raise ValueError(f"Expected labels {names}, got {tuple(labels)}.")
+    return tuple("" if labels[name] is None else str(labels[name]) for name in names)
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        # Stages running in worker threads (parsing, features) update the same series as the event loop.
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {",".join(key) or "total": value for key, value in sorted(self.values.items())}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self.values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self.series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the time spent in the with block, also when it raises.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            for key, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="%s"' % _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+    def quantile(self, counts: List[int], q: float) -> Optional[float]:
+        """
+        Upper bound of the bucket holding the q-quantile of per-bucket counts (None above the last bucket).
+        """
+        target, cumulative = q * sum(counts), 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            # Copies of the count lists, observe() keeps updating the live ones from other threads.
+            series = {key: (list(counts), total) for key, (counts, total) in self.series.items()}
+        return {
+            ",".join(key) or "total": {
+                "count": sum(counts),
+                "mean": round(total / sum(counts), 4) if sum(counts) else None,
+                "p50": self.quantile(counts, 0.5),
+                "p90": self.quantile(counts, 0.9),
+                "p99": self.quantile(counts, 0.99),
+                "buckets": dict(zip([_format_value(bound) for bound in self.buckets + (float("inf"),)], counts)),
+            }
+            for key, (counts, total) in sorted(series.items())
+        }
+
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms, exported as Prometheus text (serve / render) or as a JSON snapshot.
+
+    Stages update the shared METRICS registry below through the metric objects declared with it,
+    so no stage has to pass a registry around.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.started = time.time()
+
+    def _add(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started,
+            "elapsed_seconds": round(time.time() - self.started, 1),
+            "metrics": {name: metric.snapshot() for name, metric in self.metrics.items()},
+        }
+
+    def save_json(self, path: str, snapshot: Any = None):
+        """
+        Writes snapshot() to path (or the given snapshot, e.g. the shards' ones).
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot() if snapshot is None else snapshot, f, indent=2)
+
+    async def serve(self, port: int, host: str = "127.0.0.1") -> Optional[asyncio.AbstractServer]:
+        """
+        Starts answering every HTTP request on host:port with render(). Close the returned server when done.
+        Returns None if the port can't be bound, a run doesn't stop over its metrics endpoint.
+        """
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+                body = self.render().encode("utf-8")
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+                    + body
+                )
+                await writer.drain()
+            except Exception:
+                pass
+                # Scraper disconnected or sent garbage, nothing to answer.
+            finally:
+                writer.close()
+
+        try:
+            server = await asyncio.start_server(handle, host, port)
+        except OSError as err:
+            print(f"Metrics endpoint not started on port {port}. ERR: {err}")
+            return None
+        print(f"Metrics on http://{host}:{port}/metrics")
+        return server
+
+
+METRICS = MetricsRegistry()
+
+DOMAINS_IN = METRICS.counter("logo_stage_domains_in_total", "Domains entering a stage.", ("stage",))
+DOMAINS_OUT = METRICS.counter("logo_stage_domains_out_total", "Domains leaving a stage, by outcome (ok, failed, skipped after an earlier failure, error).", ("stage", "outcome"))
+FAILURES = METRICS.counter("logo_stage_failures_total", "Domains failing a stage, by error class.", ("stage", "error_class"))
+IN_FLIGHT = METRICS.gauge("logo_stage_in_flight", "Domains a stage is working on.", ("stage",))
+QUEUED = METRICS.gauge("logo_stage_queued", "Domains waiting in a stage's input queue.", ("stage",))
+BYTES = METRICS.counter("logo_bytes_transferred_total", "Response body bytes received, by kind (html, logo).", ("kind",))
+LATENCY = METRICS.histogram("logo_latency_seconds", "Latency of one step: dns, connect, ttfb, parse, download, resize, svg (rasterization), features.", ("step",))
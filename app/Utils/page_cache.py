@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+
+class PageCache:
+    """
+    On-disk cache of fetched HTML pages, backed by SQLite.
+
+    Pages are keyed by final URL; a second table maps each domain to the final URL it led to,
+    so domains redirecting to the same site share one stored body.
+    Bodies are stored zlib-compressed along with status, ETag, Last-Modified and fetch time.
+    Within `fresh_seconds` a cached page is used without touching the network; after that,
+    it is revalidated with If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, path: str, fresh_seconds: int = 86400, flush_every: int = 200):
+        """
+        Params:
+            path: SQLite database file. Created if missing.
+            fresh_seconds: Age under which a page is served from the cache as is.
+            flush_every: Number of buffered writes committed in one transaction.
+        """
+        self.path = path
+        self.fresh_seconds = fresh_seconds
+        self.flush_every = flush_every
+        self._pending = {}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        # Shard processes share the file, wait for each other's write transactions.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                status_code INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                body BLOB
+            )
+            """
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS page_domains (domain TEXT PRIMARY KEY, url TEXT NOT NULL)")
+        self.conn.commit()
+
+    def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        """
+        Cached page for a domain, or None.
+        """
+        entry = self._pending.get(domain)
+        if entry is not None:
+            return dict(entry)
+
+        row = self.conn.execute(
+            "SELECT p.url, p.status_code, p.etag, p.last_modified, p.fetched_at, p.body FROM page_domains d JOIN pages p ON p.url = d.url WHERE d.domain = ?",
+            (domain,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        url, status_code, etag, last_modified, fetched_at, body = row
+        try:
+            html = zlib.decompress(body).decode("utf-8") if body is not None else None
+        except (zlib.error, UnicodeDecodeError):
+            return None
+
+        return {
+            "domain": domain,
+            "url": url,
+            "status_code": status_code,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": fetched_at,
+            "html": html
+        }
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["fetched_at"] < self.fresh_seconds
+
+    def conditional_headers(self, entry: Dict[str, Any]) -> Dict[str, str]:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, domain: str, url: str, html: str, status_code: int = 200, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self._pending[domain] = {
+            "domain": domain,
+            "url": str(url),
+            "status_code": status_code,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+            "html": html
+        }
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def touch(self, domain: str, entry: Dict[str, Any]):
+        """
+        Marks a cached page as revalidated (304 Not Modified).
+        """
+        self.put(domain, entry["url"], entry["html"], entry["status_code"], entry.get("etag"), entry.get("last_modified"))
+
+    def flush(self):
+        if not self._pending:
+            return
+        pages = {}
+        for e in self._pending.values():
+            pages[e["url"]] = (
+                e["url"], e["status_code"], e["etag"], e["last_modified"], e["fetched_at"],
+                zlib.compress(e["html"].encode("utf-8"), 6) if e["html"] is not None else None
+            )
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO page_domains (domain, url) VALUES (?, ?)",
+                [(e["domain"], e["url"]) for e in self._pending.values()]
+            )
+            self.conn.executemany(
+                """
+                INSERT INTO pages (url, status_code, etag, last_modified, fetched_at, body)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    status_code=excluded.status_code,
+                    etag=excluded.etag,
+                    last_modified=excluded.last_modified,
+                    fetched_at=excluded.fetched_at,
+                    body=excluded.body
+                """,
+                list(pages.values())
+            )
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
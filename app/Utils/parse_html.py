@@ -3,6 +3,8 @@ from typing import Dict, Any, Tuple, List, Optional
 from urllib.parse import urljoin, urlparse
 
 import asyncio
+from Utils.coalesce import Coalescer
+from Utils.metrics import LATENCY
 import re
 import json
 
@@ -590,12 +592,17 @@ class LogoExtractor:
         return None
 
 
-async def extract_site_logo(res_object: Dict[str, Any]):
+async def extract_site_logo(res_object: Dict[str, Any], coalescer: Optional[Coalescer] = None):
 
     """
     Extracts the logo from a website's HTML.
+    coalescer: optional Coalescer keyed by final page URL, domains landing on the same page share one parse.
 
     """
+    if "logo" in res_object:
+        return res_object["logo"]
+        # Already extracted by the scraper (integrated logo mode).
+
     if not res_object.get("success", False):
         print(f"Skipping {res_object.get("domain", "unknown domain")}")
         return None
@@ -605,12 +612,25 @@ async def extract_site_logo(res_object: Dict[str, Any]):
     html_content = res_object["html"]
     
     try:
-        logo_href = await asyncio.to_thread(extractor.extract_logo, domain, html_content)
+        with LATENCY.time(step="parse"):
+            if coalescer is not None and res_object.get("url"):
+                logo_href, _ = await coalescer.run(str(res_object["url"]), lambda: asyncio.to_thread(extractor.extract_logo, domain, html_content))
+            else:
+                logo_href = await asyncio.to_thread(extractor.extract_logo, domain, html_content)
         if logo_href:
-            return {
+            if res_object.get("url") and not logo_href.strip().startswith(("data:", "<svg", "javascript:", "#")):
+                # Relative hrefs are relative to the final page (e.g. /en/), not the domain root. The absolute URL is
+                # what the prefetch stores the body under and what the downloader then looks up.
+                logo_href = urljoin(str(res_object["url"]), logo_href.strip())
+            logo = {
                 "domain": domain,
-                "logo_url": logo_href      
+                "logo_url": logo_href,
+                "resolved_ip": res_object.get("resolved_ip")
             }
+            if res_object.get("logo_responses"):
+                # Image bodies already seen by the headless browser, reused by the downloader.
+                logo["logo_responses"] = res_object["logo_responses"]
+            return logo
         else:
             print(f"[ERR] No logo found on domain: {domain}")
             return None
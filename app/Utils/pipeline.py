@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import namedtuple
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, List, Optional
+
+from Utils.metrics import QUEUED
+
+
+_DONE = object()
+
+# Source item starting at a later stage, e.g. a resumed domain whose logo is already downloaded:
+# Entry("features", DomainRecord(domain, resolved_ip, image_path=...))
+Entry = namedtuple("Entry", ["stage", "item"])
+
+
+class Stage:
+    """
+    One pipeline step: `workers` tasks take items from a bounded input queue and pass
+    handler(item) to the next stage. A handler returning None drops the item.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable[Any]], workers: int = 1, queue_size: int = 100):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy, 2),
+        }
+
+
+class Pipeline:
+    """
+    Streaming pipeline: stages connected by bounded asyncio queues.
+
+    Each item moves on as soon as its previous step is done, so the stages overlap (parsing while fetching,
+    downloading while parsing, ...). A full queue blocks the stage feeding it, so memory is bounded by
+    the queue sizes and worker counts, not by the input size.
+
+    pipeline = Pipeline()
+    pipeline.add_stage("fetch", scraper.fetch, workers=200, queue_size=400)
+    pipeline.add_stage("extract", extract_site_logo, workers=8)
+    await pipeline.run(source)
+    """
+
+    def __init__(self, report_every: float = 10.0, on_report: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None):
+        """
+        Params:
+            report_every: Seconds between two progress reports (0 disables them).
+            on_report: Receives snapshot() on every report instead of the progress line being printed.
+        """
+        self.stages: List[Stage] = []
+        self.report_every = report_every
+        self.on_report = on_report
+
+    def add_stage(self, name: str, handler: Callable[[Any], Awaitable[Any]], workers: int = 1, queue_size: int = 100) -> Stage:
+        stage = Stage(name, handler, workers, queue_size)
+        self.stages.append(stage)
+        return stage
+
+    async def _worker(self, stage: Stage, next_stage: Optional[Stage]):
+        while True:
+            item = await stage.queue.get()
+            QUEUED.set(stage.queue.qsize(), stage=stage.name)
+            if item is _DONE:
+                return
+
+            started = time.monotonic()
+            try:
+                result = await stage.handler(item)
+            except Exception as err:
+                print(f"Pipeline stage {stage.name} failed on an item. ERR: {err}")
+                stage.errors += 1
+                continue
+            finally:
+                stage.busy += time.monotonic() - started
+
+            stage.processed += 1
+            if result is None:
+                stage.dropped += 1
+            elif next_stage is not None:
+                await next_stage.queue.put(result)
+
+    async def _run_stage(self, index: int):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        await asyncio.gather(*(self._worker(stage, next_stage) for _ in range(stage.workers)))
+        # Every worker of this stage is done, so nothing more can reach the next one.
+        if next_stage is not None:
+            for _ in range(next_stage.workers):
+                await next_stage.queue.put(_DONE)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            if self.on_report is not None:
+                self.on_report(self.snapshot())
+                continue
+            print("Pipeline: " + ", ".join(f"{stage.name} {stage.processed} done / {stage.queue.qsize()} queued" for stage in self.stages))
+
+    async def run(self, source: AsyncIterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Feeds every item of `source` to the first stage (an Entry to the stage it names)
+        and waits until all stages are drained. Returns per-stage counters.
+        """
+        if not self.stages:
+            raise ValueError("Pipeline has no stages.")
+        by_name = {stage.name: stage for stage in self.stages}
+
+        runners = [asyncio.create_task(self._run_stage(i)) for i in range(len(self.stages))]
+        reporter = asyncio.create_task(self._report()) if self.report_every else None
+        first = self.stages[0]
+        try:
+            async for item in source:
+                if isinstance(item, Entry):
+                    await by_name[item.stage].queue.put(item.item)
+                else:
+                    await first.queue.put(item)
+            for _ in range(first.workers):
+                await first.queue.put(_DONE)
+            await asyncio.gather(*runners)
+        finally:
+            for runner in runners:
+                runner.cancel()
+            if reporter is not None:
+                reporter.cancel()
+            await asyncio.gather(*runners, *([reporter] if reporter else []), return_exceptions=True)
+
+        return self.snapshot()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {stage.name: stage.snapshot() for stage in self.stages}
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+
+class _Bucket:
+    """
+    Token bucket (GCRA form) with a minimum gap between two starts.
+    """
+
+    __slots__ = ("interval", "tolerance", "min_gap", "tat", "last_start")
+
+    def __init__(self, rate: float, burst: int, min_gap: float):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * max(burst - 1, 0)
+        self.min_gap = min_gap
+        self.tat = 0.0
+        # Theoretical arrival time of the next request.
+        self.last_start = float("-inf")
+
+    def earliest(self, now: float) -> float:
+        return max(now, self.tat - self.tolerance, self.last_start + self.min_gap)
+
+    def reserve(self, start: float):
+        self.tat = max(self.tat, start) + self.interval
+        self.last_start = start
+
+
+class PolitenessScheduler:
+    """
+    Decides when each request may start, per hostname and per resolved IP.
+
+    Many domains sit on the same shared-hosting or CDN IP, so the IP bucket keeps the total
+    rate against one server bounded even when every hostname is different.
+    A request starts once both its host bucket and its IP bucket allow it; well-behaved
+    hosts that are not shared never wait.
+    """
+
+    def __init__(self, host_rate: float = 2.0, host_burst: int = 4, host_min_gap: float = 0.1,
+                 ip_rate: float = 10.0, ip_burst: int = 20, ip_min_gap: float = 0.0):
+        """
+        Params:
+            host_rate, host_burst, host_min_gap: Requests per second, burst size and minimum gap (s) per hostname.
+            ip_rate, ip_burst, ip_min_gap: Same, per resolved IP.
+        """
+        self.host_params = (host_rate, host_burst, host_min_gap)
+        self.ip_params = (ip_rate, ip_burst, ip_min_gap)
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._reservations = 0
+
+    def _bucket(self, kind: str, key: str) -> _Bucket:
+        bucket = self._buckets.get((kind, key))
+        if bucket is None:
+            params = self.host_params if kind == "host" else self.ip_params
+            bucket = self._buckets[(kind, key)] = _Bucket(*params)
+        return bucket
+
+    def reserve(self, host: str, ip: Optional[str] = None) -> float:
+        """
+        Reserves the next start slot for a request and returns how long to wait for it (s).
+        """
+        now = time.monotonic()
+        buckets = [self._bucket("host", host.lower())]
+        if ip:
+            buckets.append(self._bucket("ip", ip))
+
+        start = max(bucket.earliest(now) for bucket in buckets)
+        for bucket in buckets:
+            bucket.reserve(start)
+
+        self._reservations += 1
+        if self._reservations % 10000 == 0:
+            self._prune(now)
+        return start - now
+
+    def throttled(self, host: str, ip: Optional[str] = None) -> bool:
+        """
+        Whether a request to the host (and IP) starting now would have to wait.
+        """
+        now = time.monotonic()
+        keys = [("host", host.lower())] + ([("ip", ip)] if ip else [])
+        return any(key in self._buckets and self._buckets[key].earliest(now) > now for key in keys)
+
+    async def wait(self, host: str, ip: Optional[str] = None) -> float:
+        """
+        Waits until the request is allowed to start. Returns the delay.
+        """
+        delay = self.reserve(host, ip)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def _prune(self, now: float):
+        # Buckets that are full again behave like new ones, so they can be dropped.
+        idle = [key for key, bucket in self._buckets.items() if bucket.tat < now and bucket.last_start + bucket.min_gap < now]
+        for key in idle:
+            del self._buckets[key]
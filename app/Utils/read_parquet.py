@@ -1,4 +1,10 @@
-import pandas as pd
+import asyncio
+import glob
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from typing import AsyncIterator, Iterator, List
 
 
 def get_links(path):
@@ -8,6 +14,9 @@ def get_links(path):
             path: .parquet file path.
     """
 
+    import pandas as pd
+    # Only this older loader uses pandas, the batch readers use pyarrow directly.
+
     try:
         links = pd.read_parquet(path)["domain"].dropna().tolist()
         res = []
@@ -15,7 +24,7 @@ def get_links(path):
         for link in links:
             if isinstance(link, str) and '.' in link:
                 res.append(link)
-                # Ensuring domains are valid. 
+                # Ensuring domains are valid.
 
         return res
     except Exception as e:
@@ -23,6 +32,83 @@ def get_links(path):
         return []
 
 
+def parquet_sources(path: str) -> List[str]:
+    """
+        Expands a .parquet file, a directory or a glob pattern into a sorted list of files.
+        Args:
+            path: .parquet file path, directory path or glob pattern.
+    """
+
+    if os.path.isdir(path):
+        pattern = os.path.join(path, "**", "*.parquet")
+        return sorted(glob.glob(pattern, recursive=True))
+    if glob.has_magic(path):
+        return sorted(p for p in glob.glob(path, recursive=True) if os.path.isfile(p))
+    if os.path.isfile(path):
+        return [path]
+    return []
+
+
+def validate_links(column: pa.Array) -> pa.Array:
+    """
+        Keeps the non-null strings that contain a '.', same rule as get_links.
+    """
+
+    if pa.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    if not pa.types.is_string(column.type):
+        column = pc.cast(column, pa.string())
+
+    mask = pc.and_kleene(pc.is_valid(column), pc.match_substring(column, "."))
+    return pc.filter(column, pc.fill_null(mask, False))
+
 
+def iter_link_batches(path: str, batch_size: int = 50_000, column: str = "domain") -> Iterator[pa.Array]:
+    """
+        Streams the links from one or many .parquet files.
+        Only the `column` is read, one row group at a time, so memory stays flat regardless of the input size.
+
+        Args:
+            path: .parquet file path, directory path or glob pattern.
+            batch_size: Maximum number of rows read per batch.
+            column: Name of the column holding the domains.
+
+        Yields:
+            Arrow string arrays with the validated links of each batch.
+    """
+
+    sources = parquet_sources(path)
+    if not sources:
+        print(f"No .parquet files found at {path}")
+        return
 
+    for source in sources:
+        try:
+            parquet_file = pq.ParquetFile(source)
+            for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=[column]):
+                links = validate_links(record_batch.column(0))
+                if len(links):
+                    yield links
+        except Exception as e:
+            print(f"Error streaming links from {source}. Error: {e}")
 
+
+async def aiter_link_batches(path: str, batch_size: int = 50_000, column: str = "domain") -> AsyncIterator[pa.Array]:
+    """
+        Async version of iter_link_batches. Decoding runs in a worker thread, and the next batch
+        is read in the background (one batch ahead) while the caller works on the current one.
+    """
+
+    batches = iter_link_batches(path, batch_size, column)
+    sentinel = object()
+
+    next_batch = asyncio.ensure_future(asyncio.to_thread(next, batches, sentinel))
+    try:
+        while True:
+            links = await next_batch
+            if links is sentinel:
+                break
+            next_batch = asyncio.ensure_future(asyncio.to_thread(next, batches, sentinel))
+            yield links
+    finally:
+        next_batch.cancel()
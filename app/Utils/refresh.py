@@ -0,0 +1,142 @@
+import heapq
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+
+class RefreshQueue:
+    """
+    Domains ordered by when their next re-crawl is due (a heap, kept in SQLite between runs).
+
+    A domain is due `interval` seconds after its last successful fetch. The interval follows how often
+    the domain's logo changes: a re-crawl finding a new logo halves it, one finding the same logo makes it
+    1.5x longer, within [min_interval, max_interval]. Failed re-crawls come back after min_interval.
+    """
+
+    def __init__(self, path: str, initial_interval: float, min_interval: float, max_interval: float):
+        """
+        Params:
+            path: SQLite database file (the state store's file can be shared).
+            initial_interval: Interval of a domain that was never re-crawled (s).
+            min_interval, max_interval: Bounds of the interval (s).
+        """
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._heap = []
+        self._due: Dict[str, float] = {}
+        # Due time of every domain, a heap entry with another due time is outdated.
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS refresh (
+                domain TEXT PRIMARY KEY,
+                due REAL NOT NULL,
+                interval REAL NOT NULL,
+                last_success REAL,
+                checks INTEGER NOT NULL DEFAULT 0,
+                changes INTEGER NOT NULL DEFAULT 0,
+                digest TEXT
+            )
+            """
+        )
+        self.conn.commit()
+
+        for domain, due in self.conn.execute("SELECT domain, due FROM refresh"):
+            self._due[domain] = due
+            self._heap.append((due, domain))
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._due)
+
+    def add(self, domains: List[str]) -> int:
+        """
+        Queues the domains not queued yet, due right away. Returns how many were new.
+        """
+        now = time.time()
+        new = [domain for domain in dict.fromkeys(domains) if domain not in self._due]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO refresh (domain, due, interval) VALUES (?, ?, ?)",
+                [(domain, now, self.initial_interval) for domain in new]
+            )
+        for domain in new:
+            self._due[domain] = now
+            heapq.heappush(self._heap, (now, domain))
+        return len(new)
+
+    def next_due(self) -> Optional[float]:
+        """
+        Due time (epoch s) of the first domain, None if the queue is empty.
+        """
+        while self._heap:
+            due, domain = self._heap[0]
+            if self._due.get(domain) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self) -> Optional[str]:
+        """
+        Takes the most overdue domain, None if no domain is due yet. It comes back once done() is called.
+        """
+        due = self.next_due()
+        if due is None or due > time.time():
+            return None
+        _, domain = heapq.heappop(self._heap)
+        return domain
+
+    def done(self, domain: str, ok: bool, digest: Optional[str] = None) -> bool:
+        """
+        Schedules the next re-crawl of a domain.
+
+        Params:
+            ok: Whether the page was fetched.
+            digest: Digest of the logo found. None when there is none or it failed to download: nothing is
+                compared then, the stored digest and the interval stay as they are.
+
+        Returns:
+            Whether the logo changed since the last successful re-crawl.
+        """
+        now = time.time()
+        row = self.conn.execute("SELECT interval, checks, changes, digest FROM refresh WHERE domain = ?", (domain,)).fetchone()
+        interval, checks, changes, previous = row if row else (self.initial_interval, 0, 0, None)
+
+        changed = False
+        if ok and digest is None:
+            digest = previous
+        elif ok:
+            changed = digest != previous
+            if checks:
+                # The first check only sets the baseline.
+                interval = interval / 2 if changed else interval * 1.5
+                interval = min(self.max_interval, max(self.min_interval, interval))
+            checks += 1
+            changes += int(changed and checks > 1)
+        if ok:
+            due = now + interval
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO refresh (domain, due, interval, last_success, checks, changes, digest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (domain, due, interval, now, checks, changes, digest)
+                )
+        else:
+            due = now + self.min_interval
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO refresh (domain, due, interval) VALUES (?, ?, ?) ON CONFLICT(domain) DO UPDATE SET due = excluded.due",
+                    (domain, due, interval)
+                )
+
+        self._due[domain] = due
+        heapq.heappush(self._heap, (due, domain))
+        return changed
+
+    def close(self):
+        self.conn.close()
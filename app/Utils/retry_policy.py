@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import itertools
+import random
+import ssl
+import time
+from collections import namedtuple
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import httpx
+
+
+# Error classes shared by the scraper and the downloader.
+NXDOMAIN = "nxdomain"
+REFUSED = "refused"
+TLS = "tls"
+TIMEOUT = "timeout"
+NETWORK = "network"
+HTTP_4XX = "http_4xx"
+HTTP_5XX = "http_5xx"
+RATE_LIMITED = "rate_limited"
+INVALID = "invalid"
+UNKNOWN = "unknown"
+
+
+RetryRule = namedtuple("RetryRule", ["max_attempts", "base_delay"])
+
+# max_attempts counts the first attempt, so 1 means "fail immediately".
+RETRY_POLICY = {
+    NXDOMAIN: RetryRule(1, 0),
+    REFUSED: RetryRule(1, 0),
+    INVALID: RetryRule(1, 0),
+    HTTP_4XX: RetryRule(1, 0),
+    TLS: RetryRule(2, 5),
+    TIMEOUT: RetryRule(3, 10),
+    NETWORK: RetryRule(3, 5),
+    HTTP_5XX: RetryRule(3, 15),
+    RATE_LIMITED: RetryRule(4, 30),
+    UNKNOWN: RetryRule(2, 5),
+}
+
+# Failures a real browser can get past (bot protection pages, JS challenges, odd servers).
+HEADLESS_CLASSES = {HTTP_4XX, HTTP_5XX, UNKNOWN}
+
+
+def classify_status(status_code: Optional[int]) -> Optional[str]:
+    """
+    Error class of a non-200 HTTP status, or None.
+    """
+    if status_code is None or status_code < 400:
+        return None
+    if status_code == 429:
+        return RATE_LIMITED
+    if status_code == 408:
+        return TIMEOUT
+    if status_code < 500:
+        return HTTP_4XX
+    return HTTP_5XX
+
+
+def is_tls_error(err: Optional[BaseException]) -> bool:
+    """
+    Whether a TLS handshake / certificate failure caused the exception. httpx wraps the ssl error
+    (a ConnectError raised from it), so its causes are checked too. Matched on types, not message text:
+    "ssl" also appears in URLs and unrelated messages.
+    """
+    for _ in range(5):
+        if err is None:
+            return False
+        if isinstance(err, (ssl.SSLError, aiohttp.ClientSSLError)):
+            return True
+        err = err.__cause__ or err.__context__
+    return False
+
+
+def classify_exception(err: BaseException) -> str:
+    """
+    Error class of a request exception, from httpx, aiohttp or the standard library.
+    """
+    message = str(err).lower()
+
+    if isinstance(err, (httpx.TimeoutException, asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+        return TIMEOUT
+    if is_tls_error(err):
+        return TLS
+    if "name or service not known" in message or "nodename nor servname" in message or "no address associated" in message:
+        return NXDOMAIN
+    if isinstance(err, ConnectionRefusedError) or "connection refused" in message:
+        return REFUSED
+    if isinstance(err, (httpx.InvalidURL, httpx.UnsupportedProtocol, aiohttp.InvalidURL)):
+        return INVALID
+    if isinstance(err, (httpx.NetworkError, httpx.RemoteProtocolError, aiohttp.ClientConnectionError, OSError)):
+        return NETWORK
+    return UNKNOWN
+
+
+def retry_delay(error_class: Optional[str], attempt: int, policy: Dict[str, RetryRule] = RETRY_POLICY) -> Optional[float]:
+    """
+    Seconds to wait before the next attempt after `attempt` (1-based) failed, or None if there is no next attempt.
+    Exponential backoff on the class's base delay, with jitter.
+    """
+    rule = policy.get(error_class, policy[UNKNOWN])
+    if attempt >= rule.max_attempts:
+        return None
+    return rule.base_delay * (2 ** (attempt - 1)) * random.uniform(1, 1.5)
+
+
+def is_permanent(error_class: Optional[str], policy: Dict[str, RetryRule] = RETRY_POLICY) -> bool:
+    return policy.get(error_class, policy[UNKNOWN]).max_attempts <= 1
+
+
+class DeferredRetryQueue:
+    """
+    Holds failed items until their retry time, without holding any concurrency slot.
+
+    Each error class has its own number of attempts and base delay (exponential backoff with jitter).
+    Permanent failures are refused right away; transient ones come back in a later pass.
+    """
+
+    def __init__(self, policy: Dict[str, RetryRule] = RETRY_POLICY):
+        self.policy = policy
+        self._heap: List[Tuple[float, int, Any, int]] = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def defer(self, item: Any, error_class: Optional[str], attempt: int) -> bool:
+        """
+        Schedules another attempt for an item that failed on `attempt` (1-based).
+        Returns False if the error class doesn't allow one more attempt.
+        """
+        delay = retry_delay(error_class, attempt, self.policy)
+        if delay is None:
+            return False
+
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), item, attempt + 1))
+        return True
+
+    async def next_pass(self) -> List[Tuple[Any, int]]:
+        """
+        Waits for the earliest retry time, then returns every (item, attempt) that is due.
+        Returns an empty list when nothing is left.
+        """
+        if not self._heap:
+            return []
+
+        delay = self._heap[0][0] - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, item, attempt = heapq.heappop(self._heap)
+            due.append((item, attempt))
+        return due
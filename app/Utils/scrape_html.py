@@ -1,22 +1,258 @@
 import asyncio
 import httpx 
-import multiprocessing
-import random
+import re
 import ssl
+import time
 import httpcore 
-from playwright.async_api import async_playwright
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from urllib.parse import urlparse 
 from Utils.headers import headers_randomizer
+from Utils.http_client import PinnedNetworkBackend, create_pinned_transport
+from Utils.browser_pool import BrowserPool
+from Utils.politeness import PolitenessScheduler
+from Utils.concurrency import AIMDLimiter, polite_wait
+from Utils.page_cache import PageCache
+from Utils.retry_policy import DeferredRetryQueue, HEADLESS_CLASSES, retry_delay, REFUSED, TIMEOUT, TLS, classify_exception, classify_status
+from Utils.host_registry import HostRegistry
+from Utils.hedging import Hedger, RequestProgress
+from Utils.logo_prefetch import prefetch_logo
+from Utils.coalesce import Coalescer
+from Utils.metrics import BYTES, LATENCY
+from config import HTML_MAX_BYTES, HTML_BODY_TAIL_BYTES, HTML_STOP_MARKERS, HEADLESS_POOL_SIZE, HEADLESS_PAGES_PER_BROWSER, HEADLESS_RENDER_MODE, HEADLESS_CAPTURE_LOGOS
+from config import LOGO_FETCH_INTEGRATED, SCRAPE_DOMAIN_BUDGET, HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_MAX_DELAY, HEDGE_MAX_RATIO
+from config import COALESCE_MAX_BYTES
 
 
 
-async def fetch_and_retry(client: httpx.AsyncClient, domain: str, ip: Optional[str], max_retries: int = 3) -> Dict[str, Any]:
+def sniff_html_encoding(content: bytes) -> Optional[str]:
     """
-    Fetch a single domain with retry logic.
+    Looks for a <meta charset> declaration at the start of the document.
     """
+    match = re.search(rb"""<meta[^>]+charset=["']?([\w-]+)""", content[:2048], re.IGNORECASE)
+    return match.group(1).decode("ascii") if match else None
+
+
+async def read_html_capped(response: httpx.Response, max_bytes: int = HTML_MAX_BYTES, body_tail: int = HTML_BODY_TAIL_BYTES, stop_markers=HTML_STOP_MARKERS) -> str:
+    """
+    Streams an HTML body and stops reading early.
+
+    Reading stops after max_bytes, after the first stop marker (</header> by default),
+    or body_tail bytes past the opening <body> tag, whichever comes first.
+    Logos almost always sit in <head> or the page header, so the rest of the page is never downloaded.
+    Only the kept bytes are decoded.
+    """
+    buffer = bytearray()
+    cutoff = max_bytes
+    scanned = 0
+    overlap = max((len(marker) for marker in stop_markers), default=0) + len(b"<body")
+    body_found = False
+
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        window = bytes(buffer[max(0, scanned - overlap):]).lower()
+        offset = max(0, scanned - overlap)
+        scanned = len(buffer)
+
+        if not body_found:
+            body_at = window.find(b"<body")
+            if body_at >= 0:
+                body_found = True
+                cutoff = min(cutoff, offset + body_at + body_tail)
+
+        for marker in stop_markers:
+            marker_at = window.find(marker)
+            if marker_at >= 0:
+                cutoff = min(cutoff, offset + marker_at + len(marker))
+
+        if len(buffer) >= cutoff:
+            break
+
+    BYTES.inc(len(buffer), kind="html")
+    content = bytes(buffer[:cutoff])
+    encoding = response.charset_encoding or sniff_html_encoding(content) or "utf-8"
+    try:
+        return content.decode(encoding, errors="replace")
+    except LookupError:
+        return content.decode("utf-8", errors="replace")
+
+
+def request_timeout(deadline: Optional[float] = None) -> httpx.Timeout:
+    """
+    Per-request timeouts, shortened so the request can't outlive the domain's deadline (time.monotonic() based).
+    """
+    total, connect = 20.0, 10.0
+    if deadline is not None:
+        remaining = max(deadline - time.monotonic(), 0.1)
+        total, connect = min(total, remaining), min(connect, remaining)
+    return httpx.Timeout(total, connect=connect, read=min(10.0, total), write=min(10.0, total))
+
+
+async def fetch_link(client: httpx.AsyncClient, link: str, original_domain: str, ip: Optional[str], headers: Dict[str, str], max_html_bytes: int = HTML_MAX_BYTES, scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, deadline: Optional[float] = None, coalescer: Optional[Coalescer] = None, progress: Optional[RequestProgress] = None) -> Dict[str, Any]:
+    """
+    One GET request for one link. Never raises, errors are reported in the returned dict
+    (success, status_code, html, url, error, error_class, redirect, etag, last_modified, latency).
+    Latency is the time until the response headers arrived, or None if there was no response.
+    With a coalescer, the body of a final URL already read (or being read) for another domain is reused, not downloaded again.
+    A hedged request's progress is told when the request goes out and when its headers arrive.
+    """
+    outcome = {
+        "success": False,
+        "status_code": None,
+        "html": None,
+        "url": None,
+        "error": None,
+        "error_class": None,
+        "redirect": None,
+        "etag": None,
+        "last_modified": None,
+        "latency": None,
+        "http_version": None,
+        "protocol_error": False
+    }
+    parsed_link = urlparse(link)
+    domain = parsed_link.netloc or parsed_link.path
+
+    try:
+        print("Modified link: ", link)
+
+        if scheduler is not None:
+            await polite_wait(scheduler, domain, ip if domain == original_domain else None)
+        if progress is not None:
+            progress.sent.set()
+        started = time.monotonic()
+        async with client.stream(
+            "GET",
+            link,
+            headers=headers,
+            timeout=request_timeout(deadline),
+            follow_redirects=True
+        ) as req:
+            outcome["latency"] = time.monotonic() - started
+            LATENCY.observe(outcome["latency"], step="ttfb")
+            if progress is not None:
+                progress.headers.set()
+            outcome["status_code"] = req.status_code
+            outcome["http_version"] = req.http_version
+
+            if req.status_code == 200:
+                outcome["success"] = True
+                if coalescer is not None:
+                    outcome["html"], _ = await coalescer.run(str(req.url), lambda: read_html_capped(req, max_bytes=max_html_bytes))
+                else:
+                    outcome["html"] = await read_html_capped(req, max_bytes=max_html_bytes)
+                outcome["url"] = req.url
+                outcome["etag"] = req.headers.get("etag")
+                outcome["last_modified"] = req.headers.get("last-modified")
+                return outcome
+
+            if req.status_code == 304:
+                return outcome
+
+            if req.status_code in (301, 302, 307, 308) and "location" in req.headers:
+                redirect_link = req.headers["location"]
+                if redirect_link.startswith(("http://", "https://")):
+                    outcome["redirect"] = redirect_link
+
+            outcome["error"] = f"{req.status_code} error."
+            outcome["error_class"] = classify_status(req.status_code)
+            # The body of a failed response is never read.
+            if limiter is not None and req.status_code in (429, 503):
+                limiter.signal_congestion()
+
+    except httpx.ConnectTimeout as err:
+        outcome["error"] = "Connection timeout."
+        outcome["error_class"] = classify_exception(err)
+        if limiter is not None:
+            limiter.signal_congestion()
+    except httpx.ConnectError as err:
+        print(f"Connection error on domain: {link}. ERR: {err}")
+        outcome["error"] = "Connection error."
+        outcome["error_class"] = classify_exception(err)
+    except httpx.HTTPStatusError as err:
+        print(f"HTTP status error on domain: {link}. ERR: {err}")
+        outcome["error"] = "HTTP status error"
+        outcome["error_class"] = classify_exception(err)
+    except httpx.RemoteProtocolError as err:
+        print(f"Protocol error on domain {link}. ERR: {err}")
+        outcome["error"] = "Protocol error."
+        outcome["error_class"] = classify_exception(err)
+        outcome["protocol_error"] = True
+    except httpx.InvalidURL as err:
+        print(f"Invalid URL on domain {link}. ERR: {err}")
+        outcome["error"] = "Invalid URL."
+        outcome["error_class"] = classify_exception(err)
+    except httpx.NetworkError as err:
+        print(f"Network error on domain {link}. ERR: {err}")
+        outcome["error"] = "Network error"
+        outcome["error_class"] = classify_exception(err)
+        if limiter is not None:
+            limiter.signal_congestion()
+    except ssl.SSLError as err:
+        print(f"SSL error on domain {link}. ERR: {err}")
+        outcome["error"] = "SSL error"
+        outcome["error_class"] = classify_exception(err)
+    except OSError as err:
+        print(f"Low level I/O error on domain {link}. ERR: {err}")
+        outcome["error"] = "OS error"
+        outcome["error_class"] = classify_exception(err)
+    except httpx.ReadTimeout as err:
+        print(f"Read timeout error on domain {domain}. ERR: {err}")
+        outcome["error"] = "Read timeout."
+        outcome["error_class"] = classify_exception(err)
+        if limiter is not None:
+            limiter.signal_congestion()
+    except Exception as err:
+        print(f"Unexpected error fetching HTML on domain: {domain}. ERR: {err}")
+        outcome["error"] = "Unexpected error fetching HTML."
+        outcome["error_class"] = classify_exception(err)
+
+    return outcome
+
+
+def record_outcome(registry: HostRegistry, link: str, outcome: Dict[str, Any], http2: bool = True):
+    """
+    Records what a request taught about its host: whether the scheme works and whether HTTP/2 does.
+    Only connection-level failures (TLS, refused) count against a scheme, not HTTP errors.
+    The negotiated version only says something about HTTP/2 if the client offered it (http2).
+    """
+    parsed_link = urlparse(link)
+    host, scheme = parsed_link.netloc, parsed_link.scheme
+    if outcome["status_code"] is not None:
+        facts = {scheme: "ok"}
+        if http2 and outcome["http_version"] and scheme == "https":
+            facts["http2"] = outcome["http_version"] == "HTTP/2"
+        registry.record(host, **facts)
+    elif http2 and outcome["protocol_error"]:
+        registry.record(host, http2=False)
+    elif outcome["error_class"] in (TLS, REFUSED):
+        registry.record(host, **{scheme: "fail"})
+
+
+async def fetch_and_retry(client: httpx.AsyncClient, domain: str, ip: Optional[str], max_html_bytes: int = HTML_MAX_BYTES, scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, page_cache: Optional[PageCache] = None, deadline: Optional[float] = None, hedger: Optional[Hedger] = None, registry: Optional[HostRegistry] = None, coalescer: Optional[Coalescer] = None, http2: bool = True) -> Dict[str, Any]:
+    """
+    Fetch a single domain, trying https, http and redirect targets once.
+    Failures carry an error_class (see retry_policy) so the caller can decide whether and when to retry.
+    The body is streamed and cut off early (see read_html_capped).
+
+    The ip isn't used to build the URL: the scraper's transport pins the domain to it,
+    so the connection skips DNS while SNI and the Host header stay the domain.
+    The scheduler (if any) decides when each request may start, per host and per IP; the scrape slot is given back while waiting.
+    Timeouts, resets and 429/503 responses are reported to the limiter (if any) as congestion.
+
+    With a page cache, a fresh cached page is returned without any request. A stale one is
+    revalidated first (If-None-Match / If-Modified-Since on its final URL) and reused on 304.
+
+    deadline (time.monotonic() based) caps every request timeout, and links left when it passes are skipped.
+    With a hedger, the first request is raced against the http version of the link (or a second connection)
+    once it is slower than the hedger's delay.
+    With a host registry, the scheme known to work is tried first and one known to fail is skipped;
+    every outcome is recorded back into it (HTTP/2 support only if the client offers it, http2).
+    With a coalescer, domains redirecting to the same final URL share one body (see fetch_link).
+    """
+    original_domain = domain
     if not domain.startswith(("http://", "https://")):
-        next_link = [f"https://{domain}", f"http://{domain}"]
+        schemes = registry.schemes(domain) if registry is not None else ["https", "http"]
+        next_link = [f"{scheme}://{domain}" for scheme in schemes]
     else:
         next_link = [domain]
     
@@ -26,241 +262,426 @@ async def fetch_and_retry(client: httpx.AsyncClient, domain: str, ip: Optional[s
         "status_code": None,
         "html": None,
         'error': None,
+        "error_class": None,
         "url": None
     }
+
+    cached = page_cache.get(original_domain) if page_cache is not None else None
+    if cached is not None:
+        if page_cache.is_fresh(cached):
+            res_object.update(success=True, status_code=cached["status_code"], html=cached["html"], url=httpx.URL(cached["url"]))
+            return res_object
+        if cached["url"] not in next_link:
+            next_link.insert(0, cached["url"])
  
     visited_links = set()
-    attempt = 0
     modified_link = None
 
-    for attempt in range(max_retries):
-        for link in list(next_link):
-            
-            if link in visited_links:
-                continue
-                # Skips visited links to avoid redirection loop.
+    def link_fetcher(link: str):
+        headers = headers_randomizer(original_domain)
+        if cached is not None and link == cached["url"]:
+            headers.update(page_cache.conditional_headers(cached))
+        return lambda progress=None: fetch_link(client, link, original_domain, ip, headers, max_html_bytes, scheduler, limiter, deadline, coalescer, progress)
 
-            visited_links.add(link)
+    # Single pass over https, http and redirect targets. Retries are deferred by the caller
+    # (see retry_policy), so no sleeping happens here while a slot is held.
+    for link in next_link:
 
-            try:
+        if link in visited_links:
+            continue
+            # Skips visited links to avoid redirection loop.
 
-                headers = headers_randomizer(domain)
-                timeout = httpx.Timeout(20.0, connect=10.0, read=10.0, write=10.0)
-                parsed_link = urlparse(link)
-                domain = parsed_link.netloc or parsed_link.path
-
-                modified_link = link
-                print("Modified link: ", modified_link)
-                
-                await asyncio.sleep(random.uniform(0.1, 0.5))
-                req = await client.get(
-                    modified_link,
-                    headers=headers,
-                    timeout=timeout,
-                    follow_redirects=True
-                )
+        if deadline is not None and time.monotonic() >= deadline:
+            res_object["error"] = "Domain deadline exceeded."
+            res_object["error_class"] = TIMEOUT
+            break
 
-                if req.status_code == 200:
-                    res_object["success"] = True
-                    res_object["status_code"] = req.status_code
-                    res_object["html"] = req.text
-                    res_object["url"] = req.url
-                    return res_object
-                
-                if req.status_code in (301, 302, 307, 308) and "location" in req.headers:
-                    redirect_link = req.headers["location"]
-                    if redirect_link.startswith(("http://", "https://")):
-                        next_link.append(redirect_link)
-
-                if attempt < max_retries - 1:
-                    # Fallback to http if https doesn't succeed.
-                    http_url = f"http://{domain}"
-                    if link.startswith("https://") and http_url not in visited_links and http_url not in next_link:
-                        next_link.append(http_url)
-                    await asyncio.sleep((attempt + 1) * 2)
-    
+        visited_links.add(link)
+        modified_link = link
 
+        if hedger is not None and len(visited_links) == 1:
+            # Only the first request of a domain is hedged.
+            backup_link = link.replace("https://", "http://", 1)
+            parsed_backup = urlparse(backup_link)
+            if registry is not None and "http" not in registry.schemes(parsed_backup.netloc):
+                backup_link = link
+                # Plain http is known to fail there, race a second connection instead.
+            host = urlparse(link).netloc
+            outcome, hedged = await hedger.race(
+                link_fetcher(link),
+                link_fetcher(backup_link),
+                lambda o: o["success"] or o["status_code"] == 304,
+                can_hedge=lambda: scheduler is None or not scheduler.throttled(host, ip)
+                # The backup goes to the same host, never while the scheduler holds that host back.
+            )
+            if hedged:
+                visited_links.add(backup_link)
+        else:
+            outcome = await link_fetcher(link)()
 
-                res_object["status_code"] = req.status_code
-            except httpx.ConnectTimeout:
-                res_object["error"] = "Connection timeout."
-                continue
-            except httpx.ConnectError as err:
-                print(f"Connection error on domain: {modified_link}. ERR: {err}")
-                res_object["error"] = "Connection error."
-            except httpx.HTTPStatusError as err:
-                print(f"HTTP status error on domain: {modified_link}. ERR: {err}")
-                res_object["error"] = "HTTP status error"
-            except httpx.InvalidURL as err:
-                print(f"Invalid URL on domain {modified_link}. ERR: {err}")
-                res_object["error"] = "Invalid URL."
-            except httpx.NetworkError as err:
-                print(f"Network error on domain {modified_link}. ERR: {err}")
-                res_object["error"] = "Network error"
-            except ssl.SSLError as err:
-                print(f"SSL error on domain {modified_link}. ERR: {err}")
-                res_object["error"] = "SSL error"
-            except OSError as err:
-                print(f"Low level I/O error on domain {modified_link}. ERR: {err}")
-                res_object["error"] = "OS error"        
-            except httpx.ReadTimeout as err:
-                print(f"Read timeout error on domain {domain}. ERR: {err}")
-            except Exception as err:
-                print(f"Unexpected error fetching HTML on domain: {domain}. ERR: {err}")
-                res_object["error"] = "Unexpected error fetching HTML."
-        if attempt < max_retries - 1:
-            await asyncio.sleep((2 ** attempt) * random.uniform(1, 2))
-    
-    if modified_link and not res_object["success"]:
-        print(f"Falling back to headless browser for {modified_link}")
-        res_object = await headless_fetch(modified_link, domain)
-        # Final attempt with headless browser.
-        
-    return res_object
+        if hedger is not None and outcome["latency"] is not None:
+            hedger.record(outcome["latency"])
+        if registry is not None:
+            record_outcome(registry, link, outcome, http2)
 
-_sem_headless = asyncio.Semaphore(3)
+        if outcome["success"]:
+            res_object.update(success=True, status_code=outcome["status_code"], html=outcome["html"], url=outcome["url"], error=None, error_class=None)
+            if page_cache is not None:
+                page_cache.put(original_domain, outcome["url"], outcome["html"], outcome["status_code"], outcome["etag"], outcome["last_modified"])
+            if registry is not None:
+                registry.record(original_domain, headless=False)
+            return res_object
 
-async def headless_fetch(url: str, domain: str) -> dict:
-    result = {
-        "domain": url,
-        "success": False,
-        "status_code": None,
-        "html": None,
-        'error': None,
-        "url": None
-    }
-    if not url:
-        return {}
-    browser = None
-    context = None
-    headers = headers_randomizer(domain)
+        if outcome["status_code"] == 304 and cached is not None:
+            # Not modified, the cached body is still valid.
+            page_cache.touch(original_domain, cached)
+            res_object.update(success=True, status_code=cached["status_code"], html=cached["html"], url=httpx.URL(cached["url"]), error=None, error_class=None)
+            return res_object
 
-    try:
-        async with _sem_headless:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                        args=[
-                            "--no-sandbox",
-                            "--disable-blink-features=AutomationControlled",
-                            "--disable-web-security",
-                            "--disable-features=VizDisplayCompositor",
-                            "--disable-dev-shm-usage",
-                            "--no-first-run",
-                            "--disable-extensions"
-                        ]
-                    )
-                
-                context = await browser.new_context(
-                    user_agent=headers["User-Agent"],
-                    viewport={"width": 1920, "height": 1080},
-                    locale="en-US",
-                    timezone_id="America/New_York",
-                    extra_http_headers={
-                        "Accept-Language": "en-US,en;q=0.9",
-                    }
-                )
+        error_class = outcome["error_class"] or classify_status(outcome["status_code"])
+        if res_object["error_class"] in HEADLESS_CLASSES and error_class not in HEADLESS_CLASSES:
+            # E.g. https 403 then http refused: the 403 is what the browser may get past, it decides the fallback.
+            error_class = res_object["error_class"]
+        res_object.update(status_code=outcome["status_code"], error=outcome["error"] or "304 error.", error_class=error_class)
+        if outcome["redirect"]:
+            next_link.append(outcome["redirect"])
 
+        # Fallback to http if https doesn't succeed.
+        parsed_link = urlparse(link)
+        http_url = f"http://{parsed_link.netloc or parsed_link.path}"
+        http_allowed = registry is None or "http" in registry.schemes(parsed_link.netloc)
+        if link.startswith("https://") and http_allowed and http_url not in visited_links and http_url not in next_link:
+            next_link.append(http_url)
 
-                page = await context.new_page()
+    if modified_link and not res_object["success"]:
+        res_object["fallback_url"] = modified_link
+        # Final attempt with the headless browser pool, done by the caller outside of its slot.
 
-                try:
-                    res = await page.goto(url, timeout=10000, wait_until="domcontentloaded")
-                
-                    if res:
-                        result["status_code"] = res.status
-                        if res.ok:
-                            result["success"] = True
-                            result["html"] = await page.content()
-                        else:
-                            result["error"] = f"{res.status} error."
-                    else:
-                        result["error"] = "No response"
-                except Exception as err:
-                    print(f"Error fetching {url} with a headless browser.")
-                finally:
-                    if "context" in locals():
-                        await context.close()
-                    if "browser" in locals():
-                        await browser.close()
+    return res_object
 
-    except Exception as err:
-        result["error"] = f"Headless browser error: {err}"
-        print(f"Unexpected error in headless browser. ERR: {err}")
- 
-    return result
 
-async def create_ssl_context() -> ssl.SSLContext:
+async def create_ssl_context(http2: bool = False) -> ssl.SSLContext:
     """
     Creates a custom SSL context for a broader server approach.
+    Each transport needs its own context: httpcore sets the ALPN protocols on it from the transport's http2 flag.
     """
     ctx = ssl.create_default_context()
-    ctx.set_alpn_protocols(["http/1.1"])
+    ctx.set_alpn_protocols(["h2", "http/1.1"] if http2 else ["http/1.1"])
     ctx.check_hostname = True 
-    # Forcing servers to use http/1, because they usually block http/2 from bots.
+    # The h2 context goes to hosts the registry doesn't know to break on HTTP/2, the http/1 one to the others.
     
     return ctx
 
 
-async def scrape_html(resolved_links: List[Dict[str, Any]]) -> List[Dict[Any, str]]:    
+class Scraper:
+    """
+    Everything fetching shares across domains: the pinned backends with their http/1 and HTTP/2 clients,
+    the headless browser pool, the hedger and the coalescers.
+
+    scrape_html drives it over a list with deferred retry passes; the streaming pipeline calls fetch()
+    one domain at a time.
+
+    async with Scraper(...) as scraper:
+        res_object = await scraper.fetch(resolved_link_pair)
+    """
+
+    def __init__(self, scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, page_cache: Optional[PageCache] = None, domain_budget: float = SCRAPE_DOMAIN_BUDGET, hedger: Optional[Hedger] = None, registry: Optional[HostRegistry] = None, integrated_logos: bool = LOGO_FETCH_INTEGRATED, logo_limiter: Optional[AIMDLimiter] = None):
+        """
+        Params:
+            scheduler: Politeness scheduler, shared with the downloader. A default one is created if None.
+            limiter: Adaptive in-flight limiter of the scrape stage. A default one is created if None.
+            page_cache: Optional on-disk page cache, used and updated by every fetch.
+            domain_budget: Seconds a single domain may spend in requests, across all its attempts and the headless fallback.
+                Time waiting for a retry doesn't count.
+            hedger: Hedges slow first requests. A default one is created if None and HEDGE_ENABLED is set.
+            registry: Optional host capability registry (schemes, HTTP/2, headless), read and updated by every fetch.
+                Hosts known to need the headless browser go straight to it, hosts where HTTP/2 failed use an http/1 client.
+            integrated_logos: Extract the logo of every fetched page and download it right away on the same client
+                and pooled connection (see logo_prefetch). logo_limiter bounds those downloads.
+
+        Pages (by final URL), logo extraction (by final URL) and integrated logo downloads (by logo URL) are coalesced,
+        so a family of domains redirecting to one site costs a single read, parse and logo download.
+        """
+        self.scheduler = scheduler or PolitenessScheduler()
+        self.limiter = limiter or AIMDLimiter("scrape", initial=50, minimum=10, maximum=1000)
+        if hedger is None and HEDGE_ENABLED:
+            hedger = Hedger(percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY, max_delay=HEDGE_MAX_DELAY, max_ratio=HEDGE_MAX_RATIO)
+        self.hedger = hedger
+        self.page_cache = page_cache
+        self.domain_budget = domain_budget
+        self.registry = registry
+        self.integrated_logos = integrated_logos
+        self.logo_limiter = logo_limiter
+
+        self.page_coalescer = Coalescer(max_completed=2000, size=len, max_bytes=COALESCE_MAX_BYTES)
+        self.parse_coalescer = Coalescer(keep=lambda logo_href: True, size=lambda logo_href: len(logo_href or ""), max_bytes=COALESCE_MAX_BYTES)
+        self.logo_coalescer = Coalescer(max_completed=2000, size=len, max_bytes=COALESCE_MAX_BYTES)
+        self.spent: Dict[str, float] = {}
+        # Seconds spent in requests so far, per domain.
+
+        self.browser_pool = BrowserPool(
+            size=HEADLESS_POOL_SIZE,
+            pages_per_browser=HEADLESS_PAGES_PER_BROWSER,
+            render_mode=HEADLESS_RENDER_MODE,
+            capture_logos=HEADLESS_CAPTURE_LOGOS
+        )
+        self.network_backend = None
+        self.http1_backend = None
+        self.async_client = None
+        self.http1_client = None
+
+    async def start(self):
+        keepalive = 40 
+        # The two transports (below) have their own pools, so the limiter's maximum is split between them
+        # instead of being given to each. Even halves: h2 multiplexes requests over fewer connections,
+        # while the http/1 pool needs one connection per request of the hosts demoted to it.
+        http1_connections = self.limiter.maximum // 2
+        limits = httpx.Limits(
+            max_connections=http1_connections,
+            max_keepalive_connections=keepalive // 2
+        )
+        http2_limits = httpx.Limits(
+            max_connections=self.limiter.maximum - http1_connections,
+            max_keepalive_connections=keepalive - keepalive // 2
+        )
+        ssl_context = await create_ssl_context()
+        http2_ssl_context = await create_ssl_context(http2=True)
+        # Connections go straight to the IPs resolved earlier (SNI and Host header stay the domain),
+        # so httpx doesn't resolve every host again through the system resolver.
+        # One backend per transport, so a preconnected stream was negotiated with the ALPN its transport offers;
+        # the pins are shared.
+        self.network_backend = PinnedNetworkBackend(ssl_context=http2_ssl_context)
+        self.http1_backend = PinnedNetworkBackend(ssl_context=ssl_context, pins=self.network_backend.pins)
+
+        # httpx ignores the client's limits / http2 once a transport is given, they belong on the transports.
+        transport = create_pinned_transport(
+            self.http1_backend,
+            verify=ssl_context,
+            limits=limits,
+            retries=1
+        )
+        # HTTP/2 is offered to hosts not known to break on it, the others stay on http/1.
+        http2_transport = create_pinned_transport(
+            self.network_backend,
+            verify=http2_ssl_context,
+            limits=http2_limits,
+            retries=1,
+            http2=True
+        )
+        self.async_client = httpx.AsyncClient(
+            transport=http2_transport,
+            follow_redirects=True,
+            timeout=20
+        )
+        self.http1_client = httpx.AsyncClient(
+            transport=transport,
+            follow_redirects=True,
+            timeout=20
+        )
+
+    async def close(self):
+        if self.hedger is not None:
+            print(f"Hedged requests: {self.hedger.snapshot()}")
+        print(f"Coalesced pages: {self.page_coalescer.snapshot()}, parses: {self.parse_coalescer.snapshot()}, logos: {self.logo_coalescer.snapshot()}")
+        await self.async_client.aclose()
+        await self.http1_client.aclose()
+        await self.browser_pool.close()
+        await self.network_backend.aclose()
+        await self.http1_backend.aclose()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def out_of_budget(self, domain: str) -> bool:
+        return self.spent.get(domain, 0.0) >= self.domain_budget
+
+    def known_headless(self, resolved_link_pair: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        (res_object, url) to render right away if the registry says plain HTTP doesn't work for this domain, else None.
+        """
+        domain = resolved_link_pair["domain"]
+        if self.registry is None or not self.registry.needs_headless(domain):
+            return None
+        known = {"domain": domain, "success": False, "status_code": None, "html": None, "error": "Known to need a headless browser.", "error_class": None, "url": None, "resolved_ip": resolved_link_pair["resolved_ip"], "attempts": 0}
+        return known, f"{self.registry.schemes(domain)[0]}://{domain}"
+
+    def route(self, domain: str) -> Tuple[httpx.AsyncClient, PinnedNetworkBackend, bool]:
+        """
+        (client, backend, http2): the HTTP/2 client unless the registry knows the host breaks on it.
+        """
+        http2 = self.registry is None or self.registry.http2(domain) is not False
+        if http2:
+            return self.async_client, self.network_backend, True
+        return self.http1_client, self.http1_backend, False
+
+    def warm(self, domain: str, ip: Optional[str]):
+        """
+        Pins a domain to its IP and starts the handshake its first request will use (scheme known to work first).
+        Called when the domain is resolved, so the handshake runs while it waits for its fetch.
+        """
+        _, backend, _ = self.route(domain)
+        backend.pin(domain, ip)
+        scheme = self.registry.schemes(domain)[0] if self.registry is not None else "https"
+        backend.preconnect(domain, 443 if scheme == "https" else 80)
+
+    async def finish(self, domain: str):
+        """
+        Drops what was kept for a domain while it was being fetched (spent time, IP pin, unused warm streams).
+        """
+        self.spent.pop(domain, None)
+        await self.network_backend.unpin(domain)
+        await self.http1_backend.unpin(domain)
+
+    def wants_headless(self, res_object: Dict[str, Any], fallback_url: Optional[str]) -> bool:
+        return bool(fallback_url) and not self.out_of_budget(res_object["domain"]) and res_object["error_class"] in HEADLESS_CLASSES
+
+    async def attempt(self, resolved_link_pair: Dict[str, Any], attempt: int) -> Dict[str, Any]:
+        """
+        One attempt at a domain (https, http and redirects), inside a scrape slot.
+        """
+        domain = resolved_link_pair["domain"]
+        resolved_ip = resolved_link_pair["resolved_ip"]
+        client, backend, http2 = self.route(domain)
+        backend.pin(domain, resolved_ip)
+        if self.limiter.saturated:
+            # Handshake while waiting for a slot, the request picks up the warm connection.
+            self.warm(domain, resolved_ip)
+
+        async with self.limiter.slot():
+            remaining = self.domain_budget - self.spent.get(domain, 0.0)
+            started = time.monotonic()
+            try:
+                # The deadline shortens request timeouts, wait_for is the hard stop (slow body reads, politeness waits).
+                res_object = await asyncio.wait_for(
+                    fetch_and_retry(client, domain, resolved_ip, scheduler=self.scheduler, limiter=self.limiter, page_cache=self.page_cache, deadline=started + remaining, hedger=self.hedger, registry=self.registry, coalescer=self.page_coalescer, http2=http2),
+                    timeout=remaining
+                )
+            except asyncio.TimeoutError:
+                res_object = {"domain": domain, "success": False, "status_code": None, "html": None, "error": "Domain deadline exceeded.", "error_class": TIMEOUT, "url": None}
+            self.spent[domain] = self.spent.get(domain, 0.0) + time.monotonic() - started
+            res_object["resolved_ip"] = resolved_ip
+            res_object["attempts"] = attempt
+
+        if self.integrated_logos and res_object["success"]:
+            # Out of the scrape slot, but soon enough for the keep-alive connection to still be open.
+            await prefetch_logo(client, res_object, scheduler=self.scheduler, limiter=self.logo_limiter, parse_coalescer=self.parse_coalescer, logo_coalescer=self.logo_coalescer)
+        return res_object
+
+    async def headless(self, res_object: Dict[str, Any], fallback_url: str) -> Dict[str, Any]:
+        # No scraper slot is held while the browser pool renders the page.
+        print(f"Falling back to headless browser for {fallback_url}")
+        domain = res_object["domain"]
+        try:
+            headless_res = await asyncio.wait_for(self.browser_pool.fetch(fallback_url, domain), timeout=self.domain_budget - self.spent.get(domain, 0.0))
+        except asyncio.TimeoutError:
+            return res_object
+        headless_res["resolved_ip"] = res_object["resolved_ip"]
+        headless_res["attempts"] = res_object["attempts"]
+        if self.registry is not None:
+            # A host that needed the browser once goes straight to it on the next run, until the browser fails too.
+            self.registry.record(domain, headless=bool(headless_res.get("success")))
+        if headless_res.get("success"):
+            if self.page_cache is not None:
+                self.page_cache.put(headless_res["domain"], headless_res["url"] or fallback_url, headless_res["html"], headless_res["status_code"])
+            return headless_res
+        return res_object
+
+    async def fetch(self, resolved_link_pair: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Whole life of one domain: attempts, retries after their error-class delay (no slot held while waiting),
+        then the headless fallback.
+        """
+        domain = resolved_link_pair["domain"]
+        known = self.known_headless(resolved_link_pair)
+        try:
+            if known is not None:
+                return await self.headless(*known)
+
+            attempt = 1
+            while True:
+                res_object = await self.attempt(resolved_link_pair, attempt)
+                fallback_url = res_object.pop("fallback_url", None)
+                if res_object["success"]:
+                    return res_object
+
+                delay = None if self.out_of_budget(domain) else retry_delay(res_object["error_class"], attempt)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                attempt += 1
+
+            if self.wants_headless(res_object, fallback_url):
+                return await self.headless(res_object, fallback_url)
+            return res_object
+        finally:
+            await self.finish(domain)
+
+
+async def scrape_html(resolved_links: List[Dict[str, Any]], scheduler: Optional[PolitenessScheduler] = None, limiter: Optional[AIMDLimiter] = None, page_cache: Optional[PageCache] = None, domain_budget: float = SCRAPE_DOMAIN_BUDGET, hedger: Optional[Hedger] = None, registry: Optional[HostRegistry] = None, integrated_logos: bool = LOGO_FETCH_INTEGRATED, logo_limiter: Optional[AIMDLimiter] = None) -> List[Dict[Any, str]]:
 
     """
     Async HTML scraper from a list of links.
     
     Params:
         links: list of resolved domains.
+        Everything else is passed to Scraper, see there.
     
     Returns:
         List of dictionaries containing each website's response as an object.
     """
-    concurrency = 200 
-    keepalive = 40 
-
     if not resolved_links:
         return []
-    
-    print(f"Starting scraper. (Concurrency: {concurrency})")
-    limits = httpx.Limits(
-        max_connections=concurrency,
-        max_keepalive_connections=keepalive
-    )
-    ssl_context = await create_ssl_context()
-    transport = httpx.AsyncHTTPTransport(
-        verify=ssl_context,
-        retries=1
-    )
-    semaphore = asyncio.Semaphore(concurrency)
+
     res = []
+    scraper = Scraper(scheduler=scheduler, limiter=limiter, page_cache=page_cache, domain_budget=domain_budget, hedger=hedger, registry=registry, integrated_logos=integrated_logos, logo_limiter=logo_limiter)
+    limiter = scraper.limiter
+    print(f"Starting scraper. (Concurrency: {limiter.limit}, max: {limiter.maximum})")
 
-    async with httpx.AsyncClient(
-        transport=transport,
-        follow_redirects=True,
-        limits=limits,
-        timeout=20,
-        http2=True
-    ) as async_client:
-        
-        async def bounded_fetch(resolved_link_pair: Dict[str, Any]) -> Dict[str, Any]:
-            async with semaphore:
-                domain = resolved_link_pair["domain"]
-                resolved_ip = resolved_link_pair["resolved_ip"]
-                await asyncio.sleep(random.uniform(0.1, 0.5))
-                return await fetch_and_retry(async_client, domain, resolved_ip)
-        
-        batch_size = 500
-        for i in range(0, len(resolved_links), batch_size):
-            batch = resolved_links[i:i+batch_size]
-            completed_batch = [bounded_fetch(resolved_link_pair) for resolved_link_pair in batch]
-            batch_results = await asyncio.gather(*(completed_batch))
-            res.extend(batch_results)
-            
-            await asyncio.sleep(random.uniform(0.1, 0.5))
+    async with scraper:
+        retry_queue = DeferredRetryQueue()
+        headless_tasks = []
+        pending = []
+        for resolved_link_pair in resolved_links:
+            known = scraper.known_headless(resolved_link_pair)
+            if known is not None:
+                headless_tasks.append(asyncio.create_task(scraper.headless(*known)))
+            else:
+                pending.append((resolved_link_pair, 1))
+        batch_size = max(500, 2 * limiter.maximum)
 
-    return res
+        # Each pass fetches whatever is due; failed domains wait in the retry queue without holding a slot,
+        # and come back in a later pass once their backoff (which depends on the error class) is over.
+        while pending:
+            # Batches only bound the number of pending tasks, the limiter decides how many run.
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i+batch_size]
+                batch_results = await asyncio.gather(*(scraper.attempt(pair, attempt) for pair, attempt in batch))
 
-            
+                for (pair, attempt), res_object in zip(batch, batch_results):
+                    fallback_url = res_object.pop("fallback_url", None)
+                    if res_object["success"]:
+                        res.append(res_object)
+                    elif not scraper.out_of_budget(pair["domain"]) and retry_queue.defer(pair, res_object["error_class"], attempt):
+                        continue
+                    elif scraper.wants_headless(res_object, fallback_url):
+                        headless_tasks.append(asyncio.create_task(scraper.headless(res_object, fallback_url)))
+                        continue
+                        # The headless fallback still reads the domain's spent time, it's finished once that's done.
+                    else:
+                        res.append(res_object)
+                    await scraper.finish(pair["domain"])
 
+                print(f"Scraped {len(res)}/{len(resolved_links)} (in flight limit: {limiter.limit}, deferred: {len(retry_queue)})")
 
-    
+            pending = await retry_queue.next_pass()
 
+        if headless_tasks:
+            for res_object in await asyncio.gather(*headless_tasks):
+                await scraper.finish(res_object["domain"])
+                res.append(res_object)
 
+    return res
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import queue
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+def shard_of(domain: str, shards: int) -> int:
+    """
+    Stable shard of a canonical domain (the same on every run and in every process, unlike hash()).
+    """
+    digest = hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def shard_path(path: str, shard_index: int) -> str:
+    """
+    Per-shard variant of an output path: Output/resolved_links.json -> Output/resolved_links.3.json
+    """
+    base, extension = os.path.splitext(path)
+    return f"{base}.{shard_index}{extension}"
+
+
+def scale_limits(limits: Dict[str, Dict[str, Any]], shards: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Splits per-stage concurrency limits between shards, so N processes together stay within the configured totals.
+    """
+    scaled = {}
+    for stage, params in limits.items():
+        params = dict(params)
+        minimum = params.get("minimum", 1)
+        for key in ("initial", "maximum"):
+            if key in params:
+                params[key] = max(minimum, params[key] // shards)
+        scaled[stage] = params
+    return scaled
+
+
+def _shard_main(run_shard: Callable[[int, int, Any], Awaitable[Dict[str, Any]]], shard_index: int, shards: int, messages):
+    try:
+        summary = asyncio.run(run_shard(shard_index, shards, messages))
+        messages.put(("done", shard_index, summary))
+    except BaseException as err:
+        messages.put(("error", shard_index, repr(err)))
+        raise
+
+
+def run_sharded(run_shard: Callable[[int, int, Any], Awaitable[Dict[str, Any]]], shards: int, report_every: float = 10.0) -> List[Optional[Dict[str, Any]]]:
+    """
+    Runs run_shard(shard_index, shards, messages) in `shards` processes, each with its own event loop.
+
+    Workers report progress with messages.put(("progress", shard_index, snapshot)); the coordinator
+    prints the merged progress every `report_every` seconds and returns each shard's summary
+    (None for a shard that crashed).
+
+    run_shard has to be a module-level coroutine function, since it is handed to a spawned process.
+    """
+    context = multiprocessing.get_context("spawn")
+    messages = context.Queue()
+    processes = [
+        context.Process(target=_shard_main, args=(run_shard, shard_index, shards, messages), name=f"shard-{shard_index}")
+        for shard_index in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    print(f"Started {shards} shard workers.")
+
+    summaries: List[Optional[Dict[str, Any]]] = [None] * shards
+    progress: Dict[int, Dict[str, Any]] = {}
+    finished = set()
+    last_report = time.monotonic()
+
+    while len(finished) < shards:
+        try:
+            kind, shard_index, payload = messages.get(timeout=1.0)
+        except queue.Empty:
+            for shard_index, process in enumerate(processes):
+                if shard_index not in finished and not process.is_alive():
+                    print(f"Shard {shard_index} exited with code {process.exitcode}.")
+                    finished.add(shard_index)
+            continue
+
+        if kind == "progress":
+            progress[shard_index] = payload
+        elif kind == "done":
+            summaries[shard_index] = payload
+            finished.add(shard_index)
+            print(f"Shard {shard_index} done.")
+        elif kind == "error":
+            finished.add(shard_index)
+            print(f"Shard {shard_index} failed. ERR: {payload}")
+
+        if report_every and time.monotonic() - last_report >= report_every and progress:
+            last_report = time.monotonic()
+            print(f"Shards [{len(finished)}/{shards} done]: " + ", ".join(
+                f"{stage} {sum(snapshot[stage]['processed'] for snapshot in progress.values() if stage in snapshot)}"
+                for stage in next(iter(progress.values()))
+            ))
+
+    for process in processes:
+        process.join()
+    return summaries
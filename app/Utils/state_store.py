@@ -0,0 +1,208 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Pipeline stages, in order. A domain's row holds the last stage it went through.
+RESOLVED = "resolved"
+FETCHED = "fetched"
+EXTRACTED = "extracted"
+DOWNLOADED = "downloaded"
+FEATURIZED = "featurized"
+
+STAGES = (RESOLVED, FETCHED, EXTRACTED, DOWNLOADED, FEATURIZED)
+
+ARTIFACTS = ("resolved_ip", "page_url", "logo_url", "image_path")
+
+# Error class of a page without a logo (the network ones come from Utils.retry_policy).
+NO_LOGO = "no_logo"
+
+
+class StateStore:
+    """
+    Durable per-domain progress, backed by SQLite.
+
+    One row per canonical domain: the last stage it went through and whether that stage succeeded,
+    the artifacts produced so far (resolved IP, final page URL, logo URL, image path), the error class
+    of a failure and the seconds spent per stage. Updates are buffered and written in batched transactions,
+    so a crashed run can resume from where each domain stopped.
+
+    Runs are recorded too (begin_run / finish_run), so a run that never finished can be told apart
+    from one that completed.
+    """
+
+    def __init__(self, path: str, flush_every: int = 500):
+        """
+        Params:
+            path: SQLite database file. Created if missing.
+            flush_every: Number of buffered domain updates committed in one transaction.
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self._pending: Dict[str, Dict[str, Any]] = {}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS domain_state (
+                domain TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                ok INTEGER NOT NULL,
+                resolved_ip TEXT,
+                page_url TEXT,
+                logo_url TEXT,
+                image_path TEXT,
+                error_class TEXT,
+                error TEXT,
+                timings TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS domain_state_stage ON domain_state (stage, ok)")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL,
+                resumed_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def begin_run(self) -> Tuple[int, bool]:
+        """
+        (run_id, resumed): the last run is picked up again if it never got to finish_run() (crashed or stopped),
+        otherwise a new run is started.
+        """
+        row = self.conn.execute("SELECT run_id, finished_at FROM runs ORDER BY run_id DESC LIMIT 1").fetchone()
+        with self.conn:
+            if row is not None and row[1] is None:
+                self.conn.execute("UPDATE runs SET resumed_at = ? WHERE run_id = ?", (time.time(), row[0]))
+                return row[0], True
+            cursor = self.conn.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),))
+        return cursor.lastrowid, False
+
+    def current_run(self) -> Optional[Tuple[int, bool]]:
+        """
+        (run_id, resumed) of the run begun last, e.g. by the sharded mode's coordinator. None if there is none.
+        """
+        row = self.conn.execute("SELECT run_id, resumed_at FROM runs ORDER BY run_id DESC LIMIT 1").fetchone()
+        return None if row is None else (row[0], row[1] is not None)
+
+    def finish_run(self, run_id: int):
+        self.flush()
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def record(self, domain: str, stage: str, ok: bool = True, error_class: Optional[str] = None, error: Optional[str] = None, seconds: Optional[float] = None, **artifacts):
+        """
+        store.record("example.com", FETCHED, ok=True, page_url="https://www.example.com/", seconds=1.2)
+
+        Artifacts left out (or None) keep their stored value.
+        """
+        entry = self._pending.get(domain)
+        if entry is None:
+            entry = self._pending[domain] = {"artifacts": {}, "timings": {}}
+        entry.update(stage=stage, ok=ok, error_class=None if ok else error_class, error=None if ok or error is None else str(error))
+        entry["artifacts"].update((key, value) for key, value in artifacts.items() if key in ARTIFACTS and value is not None)
+        if seconds is not None:
+            entry["timings"][stage] = round(seconds, 3)
+
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        now = time.time()
+        current = self.lookup(list(self._pending), include_pending=False)
+        rows = []
+        for domain, entry in self._pending.items():
+            row = current.get(domain, {})
+            timings = {**row.get("timings", {}), **entry["timings"]}
+            artifacts = {key: entry["artifacts"].get(key, row.get(key)) for key in ARTIFACTS}
+            rows.append((
+                domain, entry["stage"], int(entry["ok"]),
+                artifacts["resolved_ip"], artifacts["page_url"], artifacts["logo_url"], artifacts["image_path"],
+                entry["error_class"], entry["error"], json.dumps(timings), now
+            ))
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO domain_state
+                    (domain, stage, ok, resolved_ip, page_url, logo_url, image_path, error_class, error, timings, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+        self._pending = {}
+
+    def lookup(self, domains: List[str], include_pending: bool = True) -> Dict[str, Dict[str, Any]]:
+        """
+        Stored state of the given domains (missing ones are left out).
+        """
+        if include_pending:
+            self.flush()
+
+        found = {}
+        chunk_size = 900
+        # SQLite limits the number of bound parameters per statement.
+        for i in range(0, len(domains), chunk_size):
+            chunk = domains[i:i+chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT domain, stage, ok, resolved_ip, page_url, logo_url, image_path, error_class, error, timings FROM domain_state WHERE domain IN ({placeholders})",
+                chunk
+            ).fetchall()
+            for domain, stage, ok, resolved_ip, page_url, logo_url, image_path, error_class, error, timings in rows:
+                found[domain] = {
+                    "domain": domain,
+                    "stage": stage,
+                    "ok": bool(ok),
+                    "resolved_ip": resolved_ip,
+                    "page_url": page_url,
+                    "logo_url": logo_url,
+                    "image_path": image_path,
+                    "error_class": error_class,
+                    "error": error,
+                    "timings": json.loads(timings) if timings else {},
+                }
+        return found
+
+    def reset_stage(self, stage: str) -> int:
+        """
+        Makes `stage` run again: domains that went through it (or failed at it, or went further)
+        are moved back to the previous stage. Returns the number of domains affected.
+        """
+        self.flush()
+        index = STAGES.index(stage)
+        later = STAGES[index:]
+        placeholders = ",".join("?" * len(later))
+        with self.conn:
+            if index == 0:
+                cursor = self.conn.execute(f"DELETE FROM domain_state WHERE stage IN ({placeholders})", later)
+            else:
+                cursor = self.conn.execute(
+                    f"UPDATE domain_state SET stage = ?, ok = 1, error_class = NULL, error = NULL WHERE stage IN ({placeholders})",
+                    (STAGES[index - 1], *later)
+                )
+        return cursor.rowcount
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        self.flush()
+        counts = {stage: {"ok": 0, "failed": 0} for stage in STAGES}
+        for stage, ok, count in self.conn.execute("SELECT stage, ok, COUNT(*) FROM domain_state GROUP BY stage, ok"):
+            counts.setdefault(stage, {"ok": 0, "failed": 0})["ok" if ok else "failed"] = count
+        return counts
+
+    def close(self):
+        self.flush()
+        self.conn.close()
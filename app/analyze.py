@@ -0,0 +1,57 @@
+import os
+
+from Analyzer.image_analyzer import ImageAnalyzer
+
+from config import OUTPUT_PATH, FEATURE_STORE_PATH, INCREMENTAL, PARQUET_SOURCE, PARQUET_BATCH_SIZE
+
+
+def load_aliases():
+    """
+    Original spellings of each canonical domain, so the groups list every input spelling.
+    Only needed when the feature store has no aliases (none saved yet): reading the input needs pyarrow,
+    imported here so grouping without an input stays light.
+    """
+    from Utils.read_parquet import iter_link_batches
+    from Utils.canonicalize import DomainIndex
+
+    domain_index = DomainIndex()
+    for batch in iter_link_batches(PARQUET_SOURCE, PARQUET_BATCH_SIZE):
+        domain_index.add(batch)
+    return domain_index.aliases
+
+
+def main():
+
+    """
+    Analysis-only entry point: groups the logos already saved under OUTPUT_PATH, without loading
+    the scraping stack (browser, HTTP and DNS clients, SVG conversion).
+
+    The domains' aliases come from the feature store, written by the scraping run.
+    With INCREMENTAL, the stored features and groups are reused: only images that are new or
+    changed since the feature store was written are read, and placed into the existing groups.
+    """
+
+    logo_analyzer = ImageAnalyzer(input_dir=OUTPUT_PATH)
+    loaded = logo_analyzer.load_state(FEATURE_STORE_PATH)
+    if not logo_analyzer.aliases:
+        logo_analyzer.aliases = load_aliases()
+    aliases = logo_analyzer.aliases
+
+    if INCREMENTAL and loaded:
+        stored_at = os.path.getmtime(FEATURE_STORE_PATH)
+        known = logo_analyzer.logo_domains()
+        for img_path in logo_analyzer.load_files():
+            if img_path.stem not in known or os.path.getmtime(img_path) > stored_at:
+                logo_analyzer.add_logo(img_path)
+        removed = logo_analyzer.logo_domains() - aliases.keys() if aliases else None
+        logo_analyzer.group_and_save(incremental=True, removed=removed)
+    else:
+        logo_analyzer.logos, logo_analyzer.logo_groups = [], []
+        # Only the aliases are kept from the store, every image is read again.
+        logo_analyzer.run_analyzer()
+
+    logo_analyzer.save_state(FEATURE_STORE_PATH)
+
+
+if __name__ == "__main__":
+    main()
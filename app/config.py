@@ -11,3 +11,114 @@ OUTPUT_PATH = os.path.join(BASE_DIR, "Output")
 IMG_PATH = os.path.join(OUTPUT_PATH, "Images")
 JSON_PATH = os.path.join(OUTPUT_PATH, JSON_FILENAME)
 
+
+# Streaming ingestion. PARQUET_SOURCE can be a .parquet file, a directory or a glob pattern.
+PARQUET_SOURCE = PARQUET_PATH
+PARQUET_BATCH_SIZE = 50_000
+
+# DNS cache. Answers are kept for their TTL, clamped to [DNS_MIN_TTL, DNS_MAX_TTL].
+DNS_CACHE_PATH = os.path.join(OUTPUT_PATH, "dns_cache.sqlite3")
+DNS_NEGATIVE_TTL = 24 * 3600 # NXDOMAIN / no data.
+DNS_FAILURE_TTL = 3600 # Timeouts, SERVFAIL and other errors.
+DNS_MIN_TTL = 3600
+DNS_MAX_TTL = 7 * 24 * 3600
+
+# HTML fetching. Bodies are cut off after HTML_MAX_BYTES, the first stop marker,
+# or HTML_BODY_TAIL_BYTES past <body>, whichever comes first.
+HTML_MAX_BYTES = 512 * 1024
+HTML_BODY_TAIL_BYTES = 64 * 1024
+HTML_STOP_MARKERS = (b"</header>",)
+
+# Headless browser fallback pool.
+HEADLESS_POOL_SIZE = 3
+HEADLESS_PAGES_PER_BROWSER = 50
+HEADLESS_RENDER_MODE = "logo" # "logo" (light, early capture) or "full".
+HEADLESS_CAPTURE_LOGOS = True
+
+# Politeness. Token bucket rate (req/s), burst size and minimum gap (s), per hostname and per resolved IP.
+POLITENESS_HOST_RATE = 2.0
+POLITENESS_HOST_BURST = 4
+POLITENESS_HOST_MIN_GAP = 0.1
+POLITENESS_IP_RATE = 10.0
+POLITENESS_IP_BURST = 20
+POLITENESS_IP_MIN_GAP = 0.0
+
+# Adaptive (AIMD) concurrency per stage: starting in-flight limit and its bounds.
+CONCURRENCY_LIMITS = {
+    "resolve": {"initial": 100, "minimum": 10, "maximum": 1000},
+    "scrape": {"initial": 50, "minimum": 10, "maximum": 1000},
+    "download": {"initial": 15, "minimum": 5, "maximum": 500},
+}
+
+# HTML page cache. Pages younger than PAGE_CACHE_FRESH_SECONDS skip the network, older ones are revalidated.
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_PATH = os.path.join(OUTPUT_PATH, "page_cache.sqlite3")
+PAGE_CACHE_FRESH_SECONDS = 24 * 3600
+
+# Tail latency. A domain may spend SCRAPE_DOMAIN_BUDGET seconds in requests across all its attempts.
+# Its first request is hedged (raced against http / a second connection) once slower than the
+# HEDGE_PERCENTILE latency, clamped to [HEDGE_MIN_DELAY, HEDGE_MAX_DELAY] s, for at most HEDGE_MAX_RATIO of requests.
+SCRAPE_DOMAIN_BUDGET = 30.0
+HEDGE_ENABLED = True
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MAX_DELAY = 5.0
+HEDGE_MAX_RATIO = 0.1
+
+# Host capability registry (schemes, TLS verification, HTTP/2, headless), shared by the scraper and the downloader.
+HOST_REGISTRY_PATH = os.path.join(OUTPUT_PATH, "host_registry.sqlite3")
+HOST_REGISTRY_MAX_AGE = 30 * 24 * 3600
+
+# Integrated logo mode: the scraper extracts the logo and downloads it on the page's warm connection.
+LOGO_FETCH_INTEGRATED = True
+LOGO_MAX_BYTES = 2 * 1024 * 1024
+
+# Streaming pipeline (main_pipeline): workers per stage and size of the queue in front of each stage.
+PIPELINE_MODE = True
+PIPELINE_WORKERS = {"fetch": 200, "extract": 4, "download": 100, "features": 2}
+PIPELINE_QUEUE_SIZE = 500
+
+# Sharded mode: canonical domains are split by hash between SHARDS worker processes, each running the
+# streaming pipeline (1 = single process, PIPELINE_MODE decides).
+SHARDS = 1
+SHARD_FEATURES_PATH = os.path.join(OUTPUT_PATH, "shards", "features.pkl")
+
+# Per-domain stage state, for crash-safe resume. With RESUME, if the last run didn't finish, domains pick up at the
+# stage where they stopped (those done or failed for good are not fetched again); after a completed run, everything
+# starts over. RERUN_STAGE ("fetched", "extracted", "downloaded", ...)
+# makes that stage and the following ones run again for every stored domain.
+STATE_STORE_PATH = os.path.join(OUTPUT_PATH, "state.sqlite3")
+RESUME = True
+RERUN_STAGE = None
+
+# Incremental mode: logo features and groups are kept in FEATURE_STORE_PATH between runs. Domains already grouped
+# are not fetched again, new and changed logos are placed into the existing groups, removed domains are dropped.
+INCREMENTAL = False
+FEATURE_STORE_PATH = os.path.join(OUTPUT_PATH, "logo_features.pkl")
+
+# Refresh daemon (REFRESH_MODE): runs until stopped, re-crawling at most REFRESH_RATE domains per second as they get stale.
+# A domain is due REFRESH_INTERVAL s after its last successful fetch at first; the interval then shrinks for logos
+# that change and grows for those that don't, within [REFRESH_MIN_INTERVAL, REFRESH_MAX_INTERVAL].
+REFRESH_MODE = False
+REFRESH_RATE = 2.0
+REFRESH_WORKERS = 20
+REFRESH_INTERVAL = 7 * 24 * 3600
+REFRESH_MIN_INTERVAL = 24 * 3600
+REFRESH_MAX_INTERVAL = 60 * 24 * 3600
+REFRESH_REGROUP_EVERY = 600
+
+# Memory budget (streaming pipeline): page bodies, logo bodies and logo features are byte-accounted. Fetching pauses
+# while in-flight bodies use over MEMORY_HIGH_WATER of what the features leave of the budget, and page bodies of at least MEMORY_SPILL_BYTES then wait in temporary
+# files (a per-run directory under MEMORY_SPILL_DIR, None = system default). Sized for an 8 GB worker, leaving room for the interpreter,
+# libraries and connection buffers. Completed-request caches of the coalescers are capped at COALESCE_MAX_BYTES each.
+MEMORY_BUDGET_BYTES = 4 * 1024**3
+MEMORY_HIGH_WATER = 0.85
+MEMORY_SPILL_BYTES = 128 * 1024
+MEMORY_SPILL_DIR = None
+COALESCE_MAX_BYTES = 256 * 1024**2
+
+# Metrics: per-stage counters, in-flight gauges, bytes and latency histograms. Served as Prometheus text on
+# 127.0.0.1:METRICS_PORT while a run is going (None disables it; shard i uses METRICS_PORT + i) and written
+# to METRICS_JSON_PATH when the run ends.
+METRICS_PORT = 9108
+METRICS_JSON_PATH = os.path.join(OUTPUT_PATH, "metrics.json")
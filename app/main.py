@@ -1,15 +1,14 @@
+from __future__ import annotations
+
 import time
 import os
 import asyncio
 import json
+import pickle
+import hashlib
 
-from Utils.read_parquet import get_links
-from Utils.domain_resolver import resolve_all_domains
-from Utils.scrape_html import scrape_html
-from Utils.outputter import create_output
-from Utils.parse_html import extract_site_logo
-from Utils.download_images import image_downloader
-from Analyzer.image_analyzer import ImageAnalyzer
+# Each entry point below imports the stages it runs, so e.g. grouping alone doesn't load
+# the browser, HTTP and DNS clients (startup_benchmark.py keeps it that way).
 
 from config import * # Global declarations.
 
@@ -26,17 +25,38 @@ async def main():
     
     """
 
+    from Utils.read_parquet import aiter_link_batches
+    from Utils.canonicalize import DomainIndex
+    from Utils.domain_resolver import resolve_all_domains
+    from Utils.dns_cache import DNSCache
+    from Utils.scrape_html import scrape_html
+    from Utils.page_cache import PageCache
+    from Utils.host_registry import HostRegistry
+    from Utils.outputter import create_output
+    from Utils.parse_html import extract_site_logo
+    from Utils.download_images import image_downloader
+    from Utils.politeness import PolitenessScheduler
+    from Utils.concurrency import ConcurrencyController
+    from Utils.coalesce import Coalescer
+    from Utils.metrics import METRICS
+    from Analyzer.image_analyzer import ImageAnalyzer
+
     start_time = time.time()
+    domain_index = DomainIndex()
+    metrics_server = await METRICS.serve(METRICS_PORT) if METRICS_PORT else None
 
-    if os.path.exists(JSON_PATH):
-        with open(JSON_PATH, "r") as f:
-            resolved_ips = json.load(f) 
-            print("Loaded resolved links from .json file.")
-        f.close()
-    else:
-        domains = get_links(PARQUET_PATH)
-        print("Number of links: ", len(domains))
-        resolved_ips = await resolve_all_domains(domains)
+    # Resolution starts on the first batch instead of waiting for the whole input.
+    # Only canonical domains not seen in earlier batches reach the network,
+    # and only those missing or expired in the DNS cache are queried.
+    concurrency = ConcurrencyController(CONCURRENCY_LIMITS)
+    dns_cache = DNSCache(DNS_CACHE_PATH, negative_ttl=DNS_NEGATIVE_TTL, failure_ttl=DNS_FAILURE_TTL, min_ttl=DNS_MIN_TTL, max_ttl=DNS_MAX_TTL)
+    resolved_ips = []
+    async for batch in aiter_link_batches(PARQUET_SOURCE, PARQUET_BATCH_SIZE):
+        domains = domain_index.add(batch)
+        resolved_ips.extend(await resolve_all_domains(domains, cache=dns_cache, limiter=concurrency.stage("resolve")))
+    dns_cache.close()
+    print("Number of links: ", domain_index.rows_seen)
+    print("Unique canonical domains: ", len(domain_index))
 
     counter = 1
     if resolved_ips:
@@ -47,7 +67,17 @@ async def main():
 
     # Parse
     failed_sites_counter = 0
-    html_contents = await scrape_html(resolved_ips)
+    # One scheduler for both stages, so a shared host sees a single request rate.
+    scheduler = PolitenessScheduler(
+        host_rate=POLITENESS_HOST_RATE, host_burst=POLITENESS_HOST_BURST, host_min_gap=POLITENESS_HOST_MIN_GAP,
+        ip_rate=POLITENESS_IP_RATE, ip_burst=POLITENESS_IP_BURST, ip_min_gap=POLITENESS_IP_MIN_GAP
+    )
+    page_cache = PageCache(PAGE_CACHE_PATH, fresh_seconds=PAGE_CACHE_FRESH_SECONDS) if PAGE_CACHE_ENABLED else None
+    # What earlier runs learned about each host (working scheme, TLS, HTTP/2, headless), so it isn't probed again.
+    host_registry = HostRegistry(HOST_REGISTRY_PATH, max_age=HOST_REGISTRY_MAX_AGE)
+    html_contents = await scrape_html(resolved_ips, scheduler=scheduler, limiter=concurrency.stage("scrape"), page_cache=page_cache, registry=host_registry, logo_limiter=concurrency.stage("download"))
+    if page_cache is not None:
+        page_cache.close()
 
     for res_object in html_contents:
         if res_object["success"] == False:
@@ -56,25 +86,462 @@ async def main():
             
     print(f"Length of html_contents: {len(html_contents)}")
 
-    logo_tasks = [extract_site_logo(res_object) for res_object in html_contents]
+    # In integrated mode the scraper already extracted (and downloaded) the logos, this only collects them.
+    # Domains landing on the same final page share one parse.
+    parse_coalescer = Coalescer(keep=lambda logo_href: True, size=lambda logo_href: len(logo_href or ""), max_bytes=COALESCE_MAX_BYTES)
+    logo_tasks = [extract_site_logo(res_object, coalescer=parse_coalescer) for res_object in html_contents]
     logo_results = await asyncio.gather(*(logo_tasks))
 
     domain_logos = [result for result in logo_results if result is not None]  
 
-    await image_downloader(domain_logos, IMG_PATH)
+    await image_downloader(domain_logos, IMG_PATH, scheduler=scheduler, limiter=concurrency.stage("download"), registry=host_registry)
+    host_registry.close()
 
-    logo_analyzer = ImageAnalyzer(input_dir=OUTPUT_PATH)
+    logo_analyzer = ImageAnalyzer(input_dir=OUTPUT_PATH, aliases=domain_index.aliases)
     logo_analyzer.run_analyzer()
+    logo_analyzer.save_state(FEATURE_STORE_PATH)
+    # Features and aliases for analyze.py / a later incremental run.
 
     print("\n=== SUMMARY ===")
     print(f"Resolved: {len(resolved_ips)}")
     print(f"Scraped: {len(html_contents)}")
     print(f"Logos Found: {len(domain_logos)}")
     print(f"Failed website checks: {failed_sites_counter}")
+    for stage, state in concurrency.snapshot().items():
+        print(f"Concurrency [{stage}]: limit {state['limit']}, congestion events {state['congestion_events']}")
+    if metrics_server is not None:
+        metrics_server.close()
+    METRICS.save_json(METRICS_JSON_PATH)
     print("---%s seconds---" % (time.time() - start_time))
 
 
+async def main_pipeline(shard_index: int = None, shards: int = 1, messages=None):
+
+    """
+    Streaming version of main(): resolve -> fetch -> extract -> download -> features, connected by bounded queues.
+    Each domain moves to its next step as soon as the previous one is done, so fetching, parsing, downloading
+    and feature extraction overlap, and memory is bounded by PIPELINE_QUEUE_SIZE instead of the input size.
+    Grouping needs every logo, so it runs once the pipeline is drained.
+
+    Every step is recorded per domain in the state store; with RESUME, if the last run never finished, a domain
+    picks up at the step where that run left it, and RERUN_STAGE makes one stage run again. With INCREMENTAL, logos grouped
+    by an earlier run are reused as they are and only new or changed ones are placed into the groups.
+
+    Params:
+        shard_index, shards: Run as one shard worker of main_sharded(); only the canonical domains of this
+            shard are processed, and outputs go to per-shard files for the coordinator to merge.
+        messages: Coordinator queue for progress reports (sharded mode).
+    """
+
+    from Utils.read_parquet import aiter_link_batches
+    from Utils.canonicalize import DomainIndex
+    from Utils.domain_resolver import resolve_stream
+    from Utils.dns_cache import DNSCache
+    from Utils.scrape_html import Scraper
+    from Utils.page_cache import PageCache
+    from Utils.host_registry import HostRegistry
+    from Utils.domain_record import DomainRecord
+    from Utils.domain_steps import DomainSteps
+    from Utils.memory_budget import MemoryBudget, FEATURES, features_size
+    from Utils.state_store import StateStore, RESOLVED, EXTRACTED, DOWNLOADED, FEATURIZED, NO_LOGO
+    from Utils.retry_policy import is_permanent
+    from Utils.outputter import create_output
+    from Utils.download_images import LogoDownloader
+    from Utils.politeness import PolitenessScheduler
+    from Utils.concurrency import ConcurrencyController
+    from Utils.coalesce import Coalescer
+    from Utils.pipeline import Pipeline, Entry
+    from Utils.sharding import scale_limits, shard_of, shard_path
+    from Utils.metrics import METRICS
+    from Analyzer.image_analyzer import ImageAnalyzer
+
+    start_time = time.time()
+    sharded = shard_index is not None
+    # Every shard is its own process with its own registry, so each one serves on its own port.
+    metrics_server = await METRICS.serve(METRICS_PORT + (shard_index or 0)) if METRICS_PORT else None
+    domain_index = DomainIndex()
+    concurrency = ConcurrencyController(scale_limits(CONCURRENCY_LIMITS, shards))
+    dns_cache = DNSCache(DNS_CACHE_PATH, negative_ttl=DNS_NEGATIVE_TTL, failure_ttl=DNS_FAILURE_TTL, min_ttl=DNS_MIN_TTL, max_ttl=DNS_MAX_TTL)
+    # Hosts are split between shards, IPs aren't: each shard gets its share of the per-IP rate.
+    scheduler = PolitenessScheduler(
+        host_rate=POLITENESS_HOST_RATE, host_burst=POLITENESS_HOST_BURST, host_min_gap=POLITENESS_HOST_MIN_GAP,
+        ip_rate=POLITENESS_IP_RATE / shards, ip_burst=max(1, POLITENESS_IP_BURST // shards), ip_min_gap=POLITENESS_IP_MIN_GAP * shards
+    )
+    page_cache = PageCache(PAGE_CACHE_PATH, fresh_seconds=PAGE_CACHE_FRESH_SECONDS) if PAGE_CACHE_ENABLED else None
+    host_registry = HostRegistry(HOST_REGISTRY_PATH, max_age=HOST_REGISTRY_MAX_AGE)
+    logo_analyzer = ImageAnalyzer(input_dir=OUTPUT_PATH, aliases=domain_index.aliases)
+    if INCREMENTAL:
+        logo_analyzer.load_state(FEATURE_STORE_PATH)
+    featurized = logo_analyzer.logo_domains()
+    loaded = len(logo_analyzer.logos)
+    # Each shard gets its share of the memory budget. Loaded features stay for the whole run.
+    budget = MemoryBudget(MEMORY_BUDGET_BYTES // shards, high_water=MEMORY_HIGH_WATER, spill_bytes=MEMORY_SPILL_BYTES, spill_dir=MEMORY_SPILL_DIR, scope=f"shard-{shard_index}" if sharded else "pipeline")
+    for path, logo_features in logo_analyzer.logos:
+        budget.set(path.stem, FEATURES, features_size(logo_features))
+    parse_coalescer = Coalescer(keep=lambda logo_href: True, size=lambda logo_href: len(logo_href or ""), max_bytes=COALESCE_MAX_BYTES)
+    state = StateStore(STATE_STORE_PATH)
+    if RERUN_STAGE and not sharded:
+        print(f"Re-running stage {RERUN_STAGE} for {state.reset_stage(RERUN_STAGE)} domains.")
+    # The coordinator begins (or picks up) the run of the shards.
+    run_id, resumed = state.current_run() if sharded else state.begin_run()
+    # Stored progress is only used to pick up a run that didn't finish, or to re-run a stage,
+    # a completed run's domains are processed again from the start.
+    resuming = RESUME and (resumed or bool(RERUN_STAGE))
+    if resuming:
+        print(f"Resuming run {run_id}.")
+    resolved_ips = []
+    counts = {"resumed": 0, "finished_before": 0}
+
+    def resume_entry(row):
+        # Where a stored domain picks up again, None if an earlier run already finished it.
+        if not row["ok"] and (row["error_class"] == NO_LOGO or is_permanent(row["error_class"])):
+            return None
+        # Transient failures (timeouts, 5xx, the domain deadline, ...) go again from the stage that failed.
+        if row["stage"] == FEATURIZED and row["image_path"] and os.path.splitext(os.path.basename(row["image_path"]))[0] in featurized:
+            # Features loaded from the feature store (incremental mode).
+            return None
+        if row["stage"] in (DOWNLOADED, FEATURIZED) and row["image_path"] and os.path.exists(row["image_path"]):
+            # Features aren't stored, extracting them again from the saved image is cheap.
+            return Entry("features", DomainRecord(row["domain"], row["resolved_ip"], image_path=row["image_path"]))
+        if row["stage"] in (EXTRACTED, DOWNLOADED, FEATURIZED) and row["logo_url"]:
+            return Entry("download", DomainRecord(row["domain"], row["resolved_ip"], url=row["page_url"], extracted=True, logo_url=row["logo_url"]))
+        # Resolved or fetched: fetched pages come back from the page cache.
+        return DomainRecord(row["domain"], row["resolved_ip"])
+
+    async def resolved_domains():
+        async for batch in aiter_link_batches(PARQUET_SOURCE, PARQUET_BATCH_SIZE):
+            domains = domain_index.add(batch)
+            if sharded:
+                domains = [domain for domain in domains if shard_of(domain, shards) == shard_index]
+
+            if resuming or INCREMENTAL:
+                stored = state.lookup(domains)
+                unresolved = []
+                for domain in domains:
+                    row = stored.get(domain)
+                    if row is None or not row["resolved_ip"]:
+                        unresolved.append(domain)
+                        # Failed resolutions are retried, the DNS cache decides whether to query again.
+                        continue
+                    resolved_ips.append(DomainRecord(domain, row["resolved_ip"]))
+                    entry = resume_entry(row)
+                    if entry is None:
+                        counts["finished_before"] += 1
+                        continue
+                    counts["resumed"] += 1
+                    if isinstance(entry, DomainRecord):
+                        scraper.warm(entry.domain, entry.resolved_ip)
+                    yield entry
+                domains = unresolved
+
+            async for result in resolve_stream(domains, cache=dns_cache, limiter=concurrency.stage("resolve")):
+                state.record(result["domain"], RESOLVED, ok=result["resolved_ip"] is not None, error_class=result["status"], resolved_ip=result["resolved_ip"])
+                if result["resolved_ip"] is not None:
+                    record = DomainRecord.from_resolved(result)
+                    resolved_ips.append(record)
+                    # The handshake runs while the domain waits in the fetch queue.
+                    scraper.warm(record.domain, record.resolved_ip)
+                    yield record
+
+    on_report = (lambda snapshot: messages.put(("progress", shard_index, snapshot))) if messages is not None else None
+
+    try:
+        async with Scraper(scheduler=scheduler, limiter=concurrency.stage("scrape"), page_cache=page_cache, registry=host_registry, logo_limiter=concurrency.stage("download")) as scraper, \
+                LogoDownloader(IMG_PATH, scheduler=scheduler, limiter=concurrency.stage("download"), registry=host_registry) as downloader:
+            steps = DomainSteps(state, scraper, downloader, logo_analyzer, parse_coalescer, budget)
+            pipeline = Pipeline(on_report=on_report)
+            pipeline.add_stage("fetch", steps.fetch, workers=PIPELINE_WORKERS["fetch"], queue_size=PIPELINE_QUEUE_SIZE)
+            pipeline.add_stage("extract", steps.extract, workers=PIPELINE_WORKERS["extract"], queue_size=PIPELINE_QUEUE_SIZE)
+            pipeline.add_stage("download", steps.download, workers=PIPELINE_WORKERS["download"], queue_size=PIPELINE_QUEUE_SIZE)
+            pipeline.add_stage("features", steps.features, workers=PIPELINE_WORKERS["features"], queue_size=PIPELINE_QUEUE_SIZE)
+            stages = await pipeline.run(resolved_domains())
+    finally:
+        # Whatever happened, the progress buffered so far is kept for the next run.
+        state.close()
+        budget.close()
+        if metrics_server is not None:
+            metrics_server.close()
+
+    dns_cache.close()
+    if page_cache is not None:
+        page_cache.close()
+    host_registry.close()
+
+    summary = {
+        "rows": domain_index.rows_seen,
+        "resolved": len(resolved_ips),
+        "failed": steps.failed,
+        "resumed": counts["resumed"],
+        "finished_before": counts["finished_before"],
+        "stages": stages,
+        "concurrency": concurrency.snapshot(),
+        "memory": budget.snapshot(),
+        "metrics": METRICS.snapshot(),
+    }
+
+    if sharded:
+        # The coordinator merges these and groups the logos of every shard together.
+        create_output([record.to_json() for record in resolved_ips], shard_path(JSON_PATH, shard_index))
+        with open(shard_path(SHARD_FEATURES_PATH, shard_index), "wb") as f:
+            pickle.dump(logo_analyzer.logos[loaded:], f)
+        return summary
+
+    if resolved_ips:
+        create_output([record.to_json() for record in resolved_ips], JSON_PATH)
+    group_logos(logo_analyzer, domain_index)
+    finish_run(run_id)
+    METRICS.save_json(METRICS_JSON_PATH)
+    print_pipeline_summary(summary, time.time() - start_time)
+
+
+def finish_run(run_id: int):
+    """
+    Marks the run as completed once its groups are saved, so the next one starts over instead of resuming it.
+    """
+    from Utils.state_store import StateStore
+
+    state = StateStore(STATE_STORE_PATH)
+    state.finish_run(run_id)
+    state.close()
+
+
+def group_logos(logo_analyzer: ImageAnalyzer, domain_index: DomainIndex, incremental: bool = INCREMENTAL):
+    """
+    Groups the logos (incrementally, dropping domains no longer in the input, with `incremental`)
+    and keeps the features and groups for the next incremental run.
+    """
+    removed = logo_analyzer.logo_domains() - domain_index.aliases.keys() if incremental else None
+    if removed:
+        print(f"Dropping the logos of {len(removed)} removed domains.")
+    logo_analyzer.group_and_save(incremental=incremental, removed=removed)
+    logo_analyzer.save_state(FEATURE_STORE_PATH)
+
+
+def print_pipeline_summary(summary, elapsed: float):
+    stages = summary["stages"]
+    print("\n=== SUMMARY ===")
+    print("Number of links: ", summary["rows"])
+    print(f"Resolved: {summary['resolved']}")
+    print(f"Scraped: {stages['fetch']['processed']}")
+    print(f"Logos Found: {stages['extract']['processed'] - stages['extract']['dropped']}")
+    print(f"Logos Downloaded: {stages['download']['processed'] - stages['download']['dropped']}")
+    print(f"Failed website checks: {summary['failed']}")
+    print(f"Resumed from an earlier run: {summary['resumed']} (already finished: {summary['finished_before']})")
+    for stage, state in stages.items():
+        print(f"Pipeline [{stage}]: {state}")
+    for stage, state in summary["concurrency"].items():
+        print(f"Concurrency [{stage}]: limit {state['limit']}, congestion events {state['congestion_events']}")
+    if summary.get("memory"):
+        print(f"Memory budget: {summary['memory']}")
+    if summary.get("metrics"):
+        for step, latency in summary["metrics"]["metrics"]["logo_latency_seconds"].items():
+            print(f"Latency [{step}]: {latency['count']} samples, mean {latency['mean']} s, p50 <= {latency['p50']} s, p90 <= {latency['p90']} s")
+        print(f"Metrics snapshot: {METRICS_JSON_PATH}")
+    print("---%s seconds---" % elapsed)
+
+
+def main_sharded(shards: int = SHARDS):
+
+    """
+    Coordinator of the sharded mode: canonical domains are split by hash between `shards` processes,
+    each running main_pipeline() with its own event loop, clients and pools.
+    Per-shard outputs (resolved domains, logo features) are merged here, then the logos are grouped once.
+    """
+
+    from Utils.read_parquet import iter_link_batches
+    from Utils.canonicalize import DomainIndex
+    from Utils.state_store import StateStore
+    from Utils.outputter import create_output
+    from Utils.sharding import run_sharded, shard_path
+    from Utils.metrics import METRICS
+    from Analyzer.image_analyzer import ImageAnalyzer
+
+    start_time = time.time()
+    os.makedirs(os.path.dirname(SHARD_FEATURES_PATH), exist_ok=True)
+    # Once here, not in every shard.
+    state = StateStore(STATE_STORE_PATH)
+    if RERUN_STAGE:
+        print(f"Re-running stage {RERUN_STAGE} for {state.reset_stage(RERUN_STAGE)} domains.")
+    run_id, _ = state.begin_run()
+    state.close()
+    summaries = run_sharded(main_pipeline, shards)
+
+    resolved_ips = []
+    domain_index = DomainIndex()
+    for batch in iter_link_batches(PARQUET_SOURCE, PARQUET_BATCH_SIZE):
+        domain_index.add(batch)
+    logo_analyzer = ImageAnalyzer(input_dir=OUTPUT_PATH, aliases=domain_index.aliases)
+    if INCREMENTAL:
+        # Shards only sent the logos they added.
+        logo_analyzer.load_state(FEATURE_STORE_PATH)
+
+    for shard_index in range(shards):
+        json_path = shard_path(JSON_PATH, shard_index)
+        features_path = shard_path(SHARD_FEATURES_PATH, shard_index)
+        if os.path.exists(json_path):
+            with open(json_path, "r") as f:
+                resolved_ips.extend(json.load(f))
+            os.remove(json_path)
+        if os.path.exists(features_path):
+            with open(features_path, "rb") as f:
+                logo_analyzer.logos.extend(pickle.load(f))
+            os.remove(features_path)
+
+    if resolved_ips:
+        create_output(resolved_ips, JSON_PATH)
+    group_logos(logo_analyzer, domain_index)
+
+    done = [summary for summary in summaries if summary is not None]
+    if len(done) == shards:
+        finish_run(run_id)
+        # A crashed shard leaves the run unfinished, the next one picks it up.
+    if not done:
+        print("No shard finished.")
+        return
+    merged = {
+        "rows": domain_index.rows_seen,
+        "resolved": len(resolved_ips),
+        "failed": sum(summary["failed"] for summary in done),
+        "resumed": sum(summary["resumed"] for summary in done),
+        "finished_before": sum(summary["finished_before"] for summary in done),
+        "stages": {
+            stage: {key: sum(summary["stages"][stage][key] for summary in done) for key in done[0]["stages"][stage]}
+            for stage in done[0]["stages"]
+        },
+        "concurrency": {},
+    }
+    # Histograms of different shards can't be merged back into one snapshot's quantiles, each shard keeps its own.
+    METRICS.save_json(METRICS_JSON_PATH, {"shards": [summary["metrics"] for summary in done]})
+    print(f"Shards finished: {len(done)}/{shards}")
+    print_pipeline_summary(merged, time.time() - start_time)
+
+
+async def main_refresh():
+
+    """
+    Long-running refresh mode: instead of re-crawling everything at once, domains are re-crawled one by one
+    as they get stale (RefreshQueue: age of the last successful fetch, and how often the logo changed),
+    at most REFRESH_RATE domains per second. Changed logos are folded into the stored groups
+    every REFRESH_REGROUP_EVERY seconds. Runs until stopped; progress is kept in the state store,
+    the refresh queue and the feature store.
+    """
+
+    from Utils.read_parquet import iter_link_batches
+    from Utils.canonicalize import DomainIndex
+    from Utils.domain_resolver import resolve_stream
+    from Utils.dns_cache import DNSCache
+    from Utils.scrape_html import Scraper
+    from Utils.page_cache import PageCache
+    from Utils.host_registry import HostRegistry
+    from Utils.refresh import RefreshQueue
+    from Utils.domain_record import DomainRecord
+    from Utils.domain_steps import DomainSteps
+    from Utils.memory_budget import MemoryBudget
+    from Utils.state_store import StateStore, RESOLVED
+    from Utils.download_images import LogoDownloader
+    from Utils.politeness import PolitenessScheduler
+    from Utils.concurrency import ConcurrencyController
+    from Utils.metrics import METRICS
+    from Analyzer.image_analyzer import ImageAnalyzer
+
+    domain_index = DomainIndex()
+    for batch in iter_link_batches(PARQUET_SOURCE, PARQUET_BATCH_SIZE):
+        domain_index.add(batch)
+    queue = RefreshQueue(STATE_STORE_PATH, initial_interval=REFRESH_INTERVAL, min_interval=REFRESH_MIN_INTERVAL, max_interval=REFRESH_MAX_INTERVAL)
+    print(f"Refresh queue: {queue.add(list(domain_index.aliases))} new domains, {len(queue)} in total.")
+
+    concurrency = ConcurrencyController(CONCURRENCY_LIMITS)
+    dns_cache = DNSCache(DNS_CACHE_PATH, negative_ttl=DNS_NEGATIVE_TTL, failure_ttl=DNS_FAILURE_TTL, min_ttl=DNS_MIN_TTL, max_ttl=DNS_MAX_TTL)
+    scheduler = PolitenessScheduler(
+        host_rate=POLITENESS_HOST_RATE, host_burst=POLITENESS_HOST_BURST, host_min_gap=POLITENESS_HOST_MIN_GAP,
+        ip_rate=POLITENESS_IP_RATE, ip_burst=POLITENESS_IP_BURST, ip_min_gap=POLITENESS_IP_MIN_GAP
+    )
+    # One bucket for the whole daemon: the re-crawl budget.
+    budget = PolitenessScheduler(host_rate=REFRESH_RATE, host_burst=1, host_min_gap=0)
+    page_cache = PageCache(PAGE_CACHE_PATH, fresh_seconds=PAGE_CACHE_FRESH_SECONDS) if PAGE_CACHE_ENABLED else None
+    host_registry = HostRegistry(HOST_REGISTRY_PATH, max_age=HOST_REGISTRY_MAX_AGE)
+    logo_analyzer = ImageAnalyzer(input_dir=OUTPUT_PATH, aliases=domain_index.aliases)
+    logo_analyzer.load_state(FEATURE_STORE_PATH)
+    grouped = logo_analyzer.logo_domains()
+    # Few updates per second, written often so a stopped daemon loses little.
+    state = StateStore(STATE_STORE_PATH, flush_every=REFRESH_WORKERS)
+    memory_budget = MemoryBudget(MEMORY_BUDGET_BYTES, high_water=MEMORY_HIGH_WATER, spill_bytes=MEMORY_SPILL_BYTES, spill_dir=MEMORY_SPILL_DIR, scope="refresh")
+    counts = {"refreshed": 0, "changed": 0, "pending_logos": 0}
+    metrics_server = await METRICS.serve(METRICS_PORT) if METRICS_PORT else None
+
+    async def refresh(domain, steps):
+        result = [result async for result in resolve_stream([domain], cache=dns_cache, limiter=concurrency.stage("resolve"))][0]
+        state.record(domain, RESOLVED, ok=result["resolved_ip"] is not None, error_class=result["status"], resolved_ip=result["resolved_ip"])
+        if result["resolved_ip"] is None:
+            queue.done(domain, ok=False)
+            return
+
+        record = await steps.fetch(DomainRecord.from_resolved(result))
+        fetched = not record.error
+        record = await steps.extract(record)
+        downloaded = await steps.download(record) if record is not None else None
+        digest = None
+        if downloaded is not None:
+            with open(downloaded.image_path, "rb") as f:
+                digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+        changed = queue.done(domain, ok=fetched, digest=digest)
+        counts["refreshed"] += 1
+        image_domain = os.path.splitext(os.path.basename(downloaded.image_path))[0] if downloaded else None
+        if downloaded is not None and (changed or image_domain not in grouped):
+            if await steps.features(downloaded):
+                grouped.add(image_domain)
+                counts["changed"] += 1
+                counts["pending_logos"] += 1
+
+    async def worker(steps):
+        while True:
+            domain = queue.pop_due()
+            if domain is None:
+                next_due = queue.next_due()
+                await asyncio.sleep(min(60.0, max(1.0, next_due - time.time())) if next_due else 60.0)
+                continue
+            await budget.wait("refresh")
+            try:
+                await refresh(domain, steps)
+            except Exception as err:
+                print(f"Refresh of {domain} failed. ERR: {err}")
+                queue.done(domain, ok=False)
+
+    async def regroup():
+        while True:
+            await asyncio.sleep(REFRESH_REGROUP_EVERY)
+            print(f"Refresh: {counts['refreshed']} domains re-crawled, {counts['changed']} new or changed logos, {len(queue)} queued.")
+            if counts["pending_logos"]:
+                counts["pending_logos"] = 0
+                await asyncio.to_thread(group_logos, logo_analyzer, domain_index, True)
+
+    try:
+        async with Scraper(scheduler=scheduler, limiter=concurrency.stage("scrape"), page_cache=page_cache, registry=host_registry, logo_limiter=concurrency.stage("download")) as scraper, \
+                LogoDownloader(IMG_PATH, scheduler=scheduler, limiter=concurrency.stage("download"), registry=host_registry) as downloader:
+            steps = DomainSteps(state, scraper, downloader, logo_analyzer, budget=memory_budget)
+            await asyncio.gather(regroup(), *(worker(steps) for _ in range(REFRESH_WORKERS)))
+    finally:
+        state.close()
+        memory_budget.close()
+        queue.close()
+        dns_cache.close()
+        if page_cache is not None:
+            page_cache.close()
+        host_registry.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        METRICS.save_json(METRICS_JSON_PATH)
+        if counts["pending_logos"]:
+            group_logos(logo_analyzer, domain_index, True)
+
+
 if __name__ == "__main__":
     asyncio.set_event_loop(asyncio.new_event_loop())
     loop = asyncio.get_event_loop()
-    res = loop.run_until_complete(main())
+    if REFRESH_MODE:
+        loop.run_until_complete(main_refresh())
+    elif SHARDS > 1:
+        main_sharded(SHARDS)
+    else:
+        res = loop.run_until_complete(main_pipeline() if PIPELINE_MODE else main())
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Dependencies of the scraping stages, none of them needed just to start up.
+SCRAPING_MODULES = ["playwright", "httpx", "httpcore", "aiohttp", "aiodns", "cairosvg", "bs4", "pandas", "matplotlib", "scipy"]
+
+# Entry module -> (import time budget in seconds, top-level modules it must not load when imported).
+BUDGETS = {
+    "main": (0.3, SCRAPING_MODULES + ["cv2", "numpy", "pyarrow"]),
+    "analyze": (2.0, SCRAPING_MODULES),
+}
+
+MEASURE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted({{name.split(".")[0] for name in sys.modules}})}}))
+"""
+
+
+def measure(module: str):
+    """
+    Imports `module` in a fresh interpreter. Returns (seconds, loaded top-level modules), or raises on an import error.
+    """
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", MEASURE.format(module=module)], cwd=app_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report["seconds"], set(report["modules"])
+
+
+def main():
+
+    """
+    Startup benchmark: imports each entry point in a fresh interpreter and exits with code 1 when
+    one goes over its import time budget or loads a dependency it shouldn't need at startup.
+
+        python startup_benchmark.py [--runs 5]
+
+    The best of `runs` imports counts, to keep the check stable on a busy machine.
+    """
+
+    parser = argparse.ArgumentParser(description="Import time check of the entry points.")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    for module, (budget, forbidden) in BUDGETS.items():
+        try:
+            runs = [measure(module) for _ in range(args.runs)]
+        except Exception as err:
+            print(f"[FAIL] {module}: import failed. ERR: {err}")
+            failed = True
+            continue
+
+        seconds = min(run[0] for run in runs)
+        loaded = sorted(set(forbidden) & set.union(*(run[1] for run in runs)))
+        ok = seconds <= budget and not loaded
+        failed = failed or not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {module}: {seconds * 1000:.0f} ms (budget {budget * 1000:.0f} ms)")
+        if loaded:
+            print(f"    loads at import: {', '.join(loaded)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()